@@ -0,0 +1,90 @@
+"""
+Throughput benchmark for the de-identification stage
+
+Prints instances per second for the SCP's store path (encode, write,
+checksum, as handle_store does) and for DeidStage de-identifying the
+stored files, so DEID_WORKERS can be sized to keep up with ingest.
+
+    python bench_deid.py [instances] [workers]
+"""
+import os
+import sys
+import time
+import zlib
+import tempfile
+from io import BytesIO
+from pathlib import Path
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import generate_uid, ExplicitVRLittleEndian, CTImageStorage
+from deid import DeidStage
+
+
+def make_instances(count: int, rows: int = 512, columns: int = 512):
+    study_uid, series_uid = generate_uid(), generate_uid()
+    pixels = bytes(rows * columns * 2)
+    for i in range(count):
+        ds = Dataset()
+        ds.file_meta = FileMetaDataset()
+        ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        ds.file_meta.MediaStorageSOPClassUID = CTImageStorage
+        ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+        ds.SOPClassUID = CTImageStorage
+        ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+        ds.StudyInstanceUID = study_uid
+        ds.SeriesInstanceUID = series_uid
+        ds.PatientName = "Doe^Jane"
+        ds.PatientID = "MRN-0042"
+        ds.PatientBirthDate = "19800101"
+        ds.InstitutionName = "General Hospital"
+        ds.Modality = "CT"
+        ds.InstanceNumber = i + 1
+        ds.Rows = rows
+        ds.Columns = columns
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 0
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = "MONOCHROME2"
+        ds.PixelData = pixels
+        yield ds
+
+
+def measure_ingest(instances, directory: Path) -> tuple:
+    """Returns (stored paths, instances/s) for the store path of handle_store"""
+    paths = []
+    start = time.perf_counter()
+    for ds in instances:
+        buffer = BytesIO()
+        ds.save_as(buffer, write_like_original=False)
+        data = buffer.getbuffer()
+        path = directory / f"{ds.SOPInstanceUID}.dcm"
+        path.write_bytes(data)
+        zlib.crc32(data)
+        paths.append(path)
+    return paths, len(paths) / (time.perf_counter() - start)
+
+
+def measure_stage(paths, output: Path, workers: int, batch_size: int = 32) -> tuple:
+    """Returns (stats, instances/s) from first submit until every instance is written"""
+    stage = DeidStage()
+    stage.start("write", output, workers=workers, batch_size=batch_size, batch_wait=0.05, salt="bench")
+    start = time.perf_counter()
+    for path in paths:
+        stage.submit(path)
+    stage.close()
+    return stage.stats(), len(paths) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 2
+    with tempfile.TemporaryDirectory() as root:
+        root = Path(root)
+        (root / "buffer").mkdir()
+        paths, ingest_rate = measure_ingest(make_instances(count), root / "buffer")
+        stats, deid_rate = measure_stage(paths, root / "deid", workers)
+    print(f"{count} instances of 512x512, {workers} de-identification workers")
+    print(f"ingest (store path): {ingest_rate:8.1f} instances/s")
+    print(f"de-identification:   {deid_rate:8.1f} instances/s  {stats}")
+    print(f"de-identification keeps up with ingest: {'yes' if deid_rate >= ingest_rate else 'no'}")
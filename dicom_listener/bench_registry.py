@@ -0,0 +1,79 @@
+"""
+Memory benchmark for the study registry
+
+Prints bytes per tracked instance for StudyRegistry and for the
+dict-of-Paths layout it replaces.
+
+    python bench_registry.py [studies] [series_per_study] [instances_per_series]
+"""
+import sys
+import gc
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+from pydicom.uid import generate_uid
+from registry import StudyRegistry
+
+
+def make_instances(studies: int, series_per_study: int, instances_per_series: int):
+    for _ in range(studies):
+        study_uid, patient_id = generate_uid(), generate_uid()[-10:]
+        for _ in range(series_per_study):
+            series_uid = generate_uid()
+            for i in range(instances_per_series):
+                yield SimpleNamespace(
+                    StudyInstanceUID=study_uid,
+                    SeriesInstanceUID=series_uid,
+                    SOPInstanceUID=generate_uid(),
+                    PatientID=patient_id,
+                    Modality="CT",
+                    InstanceNumber=i + 1,
+                    ImagePositionPatient=[0.0, 0.0, float(i)],
+                    ImageOrientationPatient=[1, 0, 0, 0, 1, 0],
+                )
+
+
+def measure(build, instances) -> float:
+    """Bytes retained by build(instances) divided by the number of instances"""
+    instances = list(instances)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build(instances)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / len(instances)
+
+
+def build_registry(instances):
+    registry = StudyRegistry()
+    for ds in instances:
+        registry.add_instance(ds, 525000)
+    return registry
+
+
+def build_dicts(instances):
+    """The ad-hoc layout: nested dicts with a Path and a metadata dict per instance"""
+    studies = {}
+    for ds in instances:
+        series = studies.setdefault(ds.StudyInstanceUID, {}).setdefault(ds.SeriesInstanceUID, {})
+        series[ds.SOPInstanceUID] = {
+            "path": Path("buffer") / ds.StudyInstanceUID / ds.SeriesInstanceUID / f"{ds.SOPInstanceUID}.dcm",
+            "patient_id": ds.PatientID,
+            "modality": ds.Modality,
+            "instance_number": ds.InstanceNumber,
+            "size": 525000,
+        }
+    return studies
+
+
+if __name__ == "__main__":
+    shape = [1000, 2, 50]
+    shape[:len(sys.argv[1:4])] = [int(v) for v in sys.argv[1:4]]
+    studies, series, per_series = shape
+    total = studies * series * per_series
+    print(f"{studies} studies x {series} series x {per_series} instances = {total} instances")
+    print(f"StudyRegistry: {measure(build_registry, make_instances(studies, series, per_series)):8.1f} bytes/instance")
+    print(f"dict of Paths: {measure(build_dicts, make_instances(studies, series, per_series)):8.1f} bytes/instance")
@@ -0,0 +1,466 @@
+import os
+import queue
+import hashlib
+import logging
+import threading
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from pydicom import dcmread
+from pydicom.datadict import tag_for_keyword
+from pydicom.uid import generate_uid
+
+logger = logging.getLogger(__name__)
+
+# Action codes from DICOM PS3.15 Annex E (Basic Application Level Confidentiality Profile)
+REMOVE = 'X'
+ZERO = 'Z'
+DUMMY = 'D'
+UID = 'U'
+
+# PS3.15 Table E.1-1, Basic Profile column, for the attributes of the image
+# IODs we ingest (CT, MR, PET and their references). Not the whole table:
+# attributes of non-image IODs (structured reports, waveforms, RT plans,
+# ...) are not listed, which mark_deidentified() records.
+BASIC_PROFILE = {
+    # Patient
+    'PatientName': DUMMY,
+    'PatientID': DUMMY,
+    'PatientBirthDate': ZERO,
+    'PatientBirthTime': REMOVE,
+    'PatientSex': ZERO,
+    'PatientAge': REMOVE,
+    'PatientSize': REMOVE,
+    'PatientWeight': REMOVE,
+    'PatientAddress': REMOVE,
+    'PatientTelephoneNumbers': REMOVE,
+    'PatientMotherBirthName': REMOVE,
+    'OtherPatientIDs': REMOVE,
+    'OtherPatientNames': REMOVE,
+    'OtherPatientIDsSequence': REMOVE,
+    'EthnicGroup': REMOVE,
+    'Occupation': REMOVE,
+    'AdditionalPatientHistory': REMOVE,
+    'PatientComments': REMOVE,
+    'MedicalRecordLocator': REMOVE,
+    'IssuerOfPatientID': REMOVE,
+    'IssuerOfPatientIDQualifiersSequence': REMOVE,
+    'PatientBirthName': REMOVE,
+    'PatientBirthDateInAlternativeCalendar': REMOVE,
+    'PatientDeathDateInAlternativeCalendar': REMOVE,
+    'PatientAlternativeCalendar': REMOVE,
+    'PatientInsurancePlanCodeSequence': REMOVE,
+    'PatientPrimaryLanguageCodeSequence': REMOVE,
+    'PatientReligiousPreference': REMOVE,
+    'PatientState': REMOVE,
+    'PatientTelecomInformation': REMOVE,
+    'PatientInstitutionResidence': REMOVE,
+    'PatientTransportArrangements': REMOVE,
+    'PatientSexNeutered': REMOVE,
+    'MilitaryRank': REMOVE,
+    'BranchOfService': REMOVE,
+    'CountryOfResidence': REMOVE,
+    'RegionOfResidence': REMOVE,
+    'MedicalAlerts': REMOVE,
+    'Allergies': REMOVE,
+    'SmokingStatus': REMOVE,
+    'PregnancyStatus': REMOVE,
+    'LastMenstrualDate': REMOVE,
+    'SpecialNeeds': REMOVE,
+    'ResponsiblePerson': REMOVE,
+    'ResponsiblePersonRole': REMOVE,
+    'ResponsibleOrganization': REMOVE,
+    'ReferencedPatientAliasSequence': REMOVE,
+    'ReferencedPatientPhotoSequence': REMOVE,
+    # Study / visit
+    'AccessionNumber': ZERO,
+    'StudyID': ZERO,
+    'StudyDate': ZERO,
+    'StudyTime': ZERO,
+    'SeriesDate': REMOVE,
+    'SeriesTime': REMOVE,
+    'AcquisitionDate': REMOVE,
+    'AcquisitionTime': REMOVE,
+    'ContentDate': ZERO,
+    'ContentTime': ZERO,
+    'AcquisitionDateTime': REMOVE,
+    'ReferringPhysicianName': ZERO,
+    'PerformingPhysicianName': REMOVE,
+    'NameOfPhysiciansReadingStudy': REMOVE,
+    'OperatorsName': REMOVE,
+    'PhysiciansOfRecord': REMOVE,
+    'RequestingPhysician': REMOVE,
+    'AdmittingDiagnosesDescription': REMOVE,
+    'StudyDescription': REMOVE,
+    'SeriesDescription': REMOVE,
+    'RequestAttributesSequence': REMOVE,
+    'ReferencedPatientSequence': REMOVE,
+    'ReferencedStudySequence': REMOVE,
+    'IssuerOfAccessionNumberSequence': REMOVE,
+    'StudyComments': REMOVE,
+    'ReasonForStudy': REMOVE,
+    'RequestingService': REMOVE,
+    'RequestingPhysicianIdentificationSequence': REMOVE,
+    'ConsultingPhysicianName': REMOVE,
+    'ReferringPhysicianAddress': REMOVE,
+    'ReferringPhysicianTelephoneNumbers': REMOVE,
+    'ReferringPhysicianIdentificationSequence': REMOVE,
+    'PhysiciansOfRecordIdentificationSequence': REMOVE,
+    'PerformingPhysicianIdentificationSequence': REMOVE,
+    'PhysiciansReadingStudyIdentificationSequence': REMOVE,
+    'OperatorIdentificationSequence': REMOVE,
+    'AdmissionID': REMOVE,
+    'IssuerOfAdmissionIDSequence': REMOVE,
+    'AdmittingDate': REMOVE,
+    'AdmittingTime': REMOVE,
+    'DischargeDiagnosisDescription': REMOVE,
+    'CurrentPatientLocation': REMOVE,
+    'ReasonForVisit': REMOVE,
+    'VisitComments': REMOVE,
+    'ServiceEpisodeID': REMOVE,
+    'ServiceEpisodeDescription': REMOVE,
+    'PlacerOrderNumberImagingServiceRequest': ZERO,
+    'FillerOrderNumberImagingServiceRequest': ZERO,
+    'OrderEnteredBy': REMOVE,
+    'OrderEntererLocation': REMOVE,
+    'OrderCallbackPhoneNumber': REMOVE,
+    'ImagingServiceRequestComments': REMOVE,
+    'RequestedProcedureID': REMOVE,
+    'RequestedProcedureDescription': REMOVE,
+    'RequestedProcedureComments': REMOVE,
+    'RequestedContrastAgent': REMOVE,
+    'ReasonForTheRequestedProcedure': REMOVE,
+    'ScheduledProcedureStepDescription': REMOVE,
+    'ScheduledProcedureStepStartDate': REMOVE,
+    'ScheduledProcedureStepEndDate': REMOVE,
+    'ScheduledPerformingPhysicianName': REMOVE,
+    'ScheduledStepAttributesSequence': REMOVE,
+    'PerformedProcedureStepID': REMOVE,
+    'PerformedProcedureStepDescription': REMOVE,
+    'PerformedProcedureStepStartDate': REMOVE,
+    'PerformedProcedureStepStartTime': REMOVE,
+    'PerformedProcedureStepEndDate': REMOVE,
+    'PerformedProcedureStepEndTime': REMOVE,
+    'PerformedProcedureTypeDescription': REMOVE,
+    'PerformedStationName': REMOVE,
+    'CommentsOnThePerformedProcedureStep': REMOVE,
+    'ProtocolName': REMOVE,
+    'TimezoneOffsetFromUTC': REMOVE,
+    # Series / instance content
+    'ImageComments': REMOVE,
+    'FrameComments': REMOVE,
+    'AcquisitionComments': REMOVE,
+    'DerivationDescription': REMOVE,
+    'AcquisitionDeviceProcessingDescription': REMOVE,
+    'ContrastBolusAgent': DUMMY,
+    'OverlayDate': REMOVE,
+    'OverlayTime': REMOVE,
+    'TextComments': REMOVE,
+    'TextString': REMOVE,
+    'ImagePresentationComments': REMOVE,
+    'IconImageSequence': REMOVE,
+    'ContentCreatorName': ZERO,
+    'ContentCreatorIdentificationCodeSequence': REMOVE,
+    'VerifyingObserverName': DUMMY,
+    'VerifyingObserverIdentificationCodeSequence': ZERO,
+    'VerifyingOrganization': REMOVE,
+    'PersonName': DUMMY,
+    'PersonAddress': REMOVE,
+    'PersonTelephoneNumbers': REMOVE,
+    'ParticipantSequence': REMOVE,
+    'AuthorObserverSequence': REMOVE,
+    'ModifiedAttributesSequence': REMOVE,
+    'OriginalAttributesSequence': REMOVE,
+    'DigitalSignaturesSequence': REMOVE,
+    'MACParametersSequence': REMOVE,
+    'DataSetTrailingPadding': REMOVE,
+    # Equipment / site
+    'InstitutionName': REMOVE,
+    'InstitutionAddress': REMOVE,
+    'InstitutionalDepartmentName': REMOVE,
+    'StationName': REMOVE,
+    'DeviceSerialNumber': REMOVE,
+    'InstitutionCodeSequence': REMOVE,
+    'InstitutionalDepartmentTypeCodeSequence': REMOVE,
+    'ManufacturerModelName': REMOVE,
+    'SoftwareVersions': REMOVE,
+    'DeviceDescription': REMOVE,
+    'DetectorID': DUMMY,
+    'GantryID': REMOVE,
+    'PlateID': REMOVE,
+    'CassetteID': REMOVE,
+    'GeneratorID': REMOVE,
+    # UIDs
+    'StudyInstanceUID': UID,
+    'SeriesInstanceUID': UID,
+    'SOPInstanceUID': UID,
+    'FrameOfReferenceUID': UID,
+    'ReferencedSOPInstanceUID': UID,
+    'ReferencedFrameOfReferenceUID': UID,
+    'SynchronizationFrameOfReferenceUID': UID,
+    'IrradiationEventUID': UID,
+    'StorageMediaFileSetUID': UID,
+    'InstanceCreatorUID': UID,
+    'CreatorVersionUID': UID,
+    'DeviceUID': UID,
+    'UID': UID,
+    'ConcatenationUID': UID,
+    'DimensionOrganizationUID': UID,
+    'RelatedFrameOfReferenceUID': UID,
+    'TransactionUID': UID,
+    'DoseReferenceUID': UID,
+    'FiducialUID': UID,
+    'ReferencedSOPInstanceUIDInFile': UID,
+}
+
+DUMMY_VALUES = {
+    'PN': 'ANONYMOUS',
+    'DA': '19000101',
+    'TM': '000000',
+    'DT': '19000101000000',
+}
+
+
+@lru_cache(maxsize=65536)
+def remap_uid(uid: str, salt: str) -> str:
+    """Deterministic replacement UID: the same input always maps to the same 2.25 UID"""
+    return generate_uid(prefix=None, entropy_srcs=[salt, uid])
+
+
+def pseudonym(value: str, salt: str) -> str:
+    return hashlib.sha256(f"{salt}:{value}".encode()).hexdigest()[:16].upper()
+
+
+def compile_profile(profile: dict = BASIC_PROFILE) -> dict:
+    """Turn a keyword -> action profile into a tag-indexed rule table"""
+    rules = {}
+    for keyword, action in profile.items():
+        tag = tag_for_keyword(keyword)
+        if tag is None:
+            raise ValueError(f"Unknown DICOM keyword in de-identification profile: {keyword}")
+        rules[tag] = action
+    return rules
+
+
+def deidentify(ds, rules: dict, salt: str = '', remove_private: bool = True):
+    """
+    Apply compiled rules to a dataset in place, recursing into sequences
+
+    Only tags present in both the dataset and the rule table are visited,
+    so the cost scales with what the dataset actually contains.
+    """
+    for tag in rules.keys() & ds.keys():
+        action = rules[tag]
+        if action == REMOVE:
+            del ds[tag]
+            continue
+
+        elem = ds[tag]
+        if action == ZERO:
+            elem.value = ''
+        elif action == UID:
+            if elem.VM > 1:
+                elem.value = [remap_uid(str(v), salt) for v in elem.value]
+            elif elem.value:
+                elem.value = remap_uid(str(elem.value), salt)
+        elif action == DUMMY:
+            elem.value = DUMMY_VALUES.get(elem.VR) or pseudonym(str(elem.value), salt)
+
+    if remove_private:
+        # Per level only; Dataset.remove_private_tags() would re-walk every nested item
+        for tag in [tag for tag in ds.keys() if tag.is_private]:
+            del ds[tag]
+
+    for elem in ds:
+        if elem.VR == 'SQ':
+            for item in elem.value:
+                deidentify(item, rules, salt, remove_private)
+    return ds
+
+
+def mark_deidentified(ds):
+    """Keep file meta consistent and record which rules were applied (not the full Basic Profile)"""
+    ds.PatientIdentityRemoved = 'YES'
+    ds.DeidentificationMethod = 'dicom-gw: PS3.15 Basic Profile actions for image IOD attributes'
+    if getattr(ds, 'file_meta', None) is not None and 'SOPInstanceUID' in ds:
+        ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+    return ds
+
+
+# ===== Worker process side =====
+_worker = {}
+
+
+def _init_worker(options: dict):
+    """Compile the rule set once per worker process"""
+    _worker['rules'] = compile_profile()
+    _worker['options'] = options
+    _worker['assoc'] = None
+
+
+def _forward(ds):
+    from pynetdicom import AE
+    from pynetdicom.sop_class import CTImageStorage
+
+    assoc = _worker['assoc']
+    if assoc is None or not assoc.is_established:
+        host, port, ae_title = _worker['options']['forward']
+        ae = AE(ae_title='DICOM_DEID')
+        ae.add_requested_context(CTImageStorage)
+        assoc = _worker['assoc'] = ae.associate(host, port, ae_title=ae_title)
+        if not assoc.is_established:
+            _worker['assoc'] = None
+            raise ConnectionError(f"Association rejected by {host}:{port}")
+    status = assoc.send_c_store(ds)
+    if not status or status.Status != 0x0000:
+        raise RuntimeError(f"Forward failed with status {status.Status if status else 'none'}")
+
+
+def deidentify_batch(paths: list) -> tuple:
+    """Worker entry point; returns (succeeded, failed)"""
+    options = _worker['options']
+    succeeded = failed = 0
+    for path in paths:
+        try:
+            ds = mark_deidentified(deidentify(dcmread(path), _worker['rules'], options['salt']))
+            if options['mode'] == 'forward':
+                _forward(ds)
+            else:
+                out_dir = Path(options['output_path']) / ds.StudyInstanceUID / ds.SeriesInstanceUID
+                out_dir.mkdir(parents=True, exist_ok=True)
+                ds.save_as(out_dir / f"{ds.SOPInstanceUID}.dcm", write_like_original=False)
+            succeeded += 1
+        except Exception as e:
+            logger.error(f"De-identification failed for {path}: {e}")
+            failed += 1
+    return succeeded, failed
+
+
+# ===== Pipeline stage (SCP process side) =====
+class DeidStage:
+    """Batches stored instances and de-identifies them on a process pool"""
+
+    def __init__(self, queue_size: int = 1024):
+        # Bounded: a slow sink blocks submit(), which slows the sending association
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.executor = None
+        self.thread = None
+        self.in_flight = None
+        self.lock = threading.Lock()
+        self.succeeded = 0
+        self.failed = 0
+        self.stalled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.executor is not None
+
+    def start(self, mode: str, output_path: Path, forward=None, workers: int = None,
+              batch_size: int = 32, batch_wait: float = 0.5, salt: str = ''):
+        if mode not in ('write', 'forward'):
+            raise ValueError(f"Unknown de-identification mode: {mode}")
+        if mode == 'forward' and not forward:
+            raise ValueError("Forward mode needs a (host, port, ae_title) target")
+        if not salt:
+            logger.warning("DEID_UID_SALT is empty; remapped UIDs can be recomputed from the originals")
+
+        workers = workers or os.cpu_count() or 2
+        options = {
+            'mode': mode,
+            'output_path': str(output_path),
+            'forward': forward,
+            'salt': salt,
+        }
+        # spawn: forking a process that is running association threads is unsafe
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(options,),
+        )
+        # Bound batches handed to the pool; together with the bounded queue a slow sink stalls ingest
+        self.in_flight = threading.BoundedSemaphore(workers * 2)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.thread = threading.Thread(target=self._run, daemon=True, name='deid-batcher')
+        self.thread.start()
+        logger.info(f"De-identification stage started: {mode}, {workers} workers")
+
+    def submit(self, path: Path) -> bool:
+        """
+        Queue a stored instance, blocking while the stage is saturated
+
+        Never sheds: every stored instance reaches the sink. The wait holds
+        up the C-STORE response, so a sending SCU slows to the sink's pace.
+        """
+        if not self.enabled:
+            return False
+        try:
+            self.queue.put_nowait(str(path))
+        except queue.Full:
+            with self.lock:
+                self.stalled += 1
+            self.queue.put(str(path))
+        return True
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=self.batch_wait)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self.in_flight.acquire()
+            try:
+                future = self.executor.submit(deidentify_batch, batch)
+            except Exception as e:
+                # e.g. BrokenProcessPool; keep draining so close() still returns
+                self.in_flight.release()
+                logger.error(f"De-identification batch rejected: {e}")
+                with self.lock:
+                    self.failed += len(batch)
+                continue
+            future.add_done_callback(functools.partial(self._done, len(batch)))
+
+    def _done(self, size: int, future):
+        self.in_flight.release()
+        try:
+            succeeded, failed = future.result()
+        except Exception as e:
+            # e.g. BrokenProcessPool: the whole batch is lost
+            logger.error(f"De-identification batch failed: {e}")
+            succeeded, failed = 0, size
+        with self.lock:
+            self.succeeded += succeeded
+            self.failed += failed
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "stalled": self.stalled,
+                "queued": self.queue.qsize(),
+            }
+
+    def close(self):
+        """Flush queued instances and stop the workers"""
+        if not self.enabled:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+        self.executor = None
+        logger.info(f"De-identification stage stopped: {self.stats()}")
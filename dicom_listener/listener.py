@@ -1,25 +1,63 @@
 import os
+import time
+import zlib
+import tempfile
 import logging
-import pika
-import json
-import pydicom
+import threading
+from io import BytesIO
 from pathlib import Path
+from pydicom import dcmread
 from pynetdicom import AE, evt
 from pynetdicom.sop_class import Verification, CTImageStorage
 import ssl
 from typing import Optional
+from tracing import tracer
+from deid import DeidStage
+from registry import StudyRegistry
+from notifications import resolve_encoding, resolve_manifest_mode, study_notification, encode_messages
+from tls import resolve_ciphers, enable_session_resumption, instrument_context, handshake_stats
 
 
 class Config:
-    STORAGE_PATH = Path("./buffer")
-    LISTEN_PORT = 11112
-    AE_TITLE = "DICOM_GATEWAY"
+    STORAGE_PATH = Path(os.getenv('STORAGE_PATH', './buffer'))
+    LISTEN_PORT = int(os.getenv('LISTEN_PORT', 11112))
+    AE_TITLE = os.getenv('AE_TITLE', 'DICOM_GATEWAY')
     CERT_DIR = Path("certs")
     SERVER_CRT = CERT_DIR / "server.crt"
     SERVER_KEY = CERT_DIR / "server.key"
     TLS_ENABLED = os.getenv('TLS_ENABLED', 'false').lower() == 'true'
+    # 'strict' (AES-256-GCM), 'performance' (AES-128-GCM/ChaCha20 first), 'chacha20' or a raw cipher string
+    TLS_CIPHER_POLICY = os.getenv('TLS_CIPHER_POLICY', 'strict')
+    # Session tickets issued per full handshake; 0 disables ticket resumption
+    TLS_SESSION_TICKETS = int(os.getenv('TLS_SESSION_TICKETS', 2))
     RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'rabbitmq')
     RABBITMQ_QUEUE = 'new_study'
+    GATEWAY_API_URL = os.getenv('GATEWAY_API_URL', 'http://dicom-gw:8000')
+    # De-identification after storage: off | write (copy to DEID_OUTPUT_PATH) | forward (C-STORE to DEID_FORWARD)
+    DEID_MODE = os.getenv('DEID_MODE', 'off').lower()
+    DEID_OUTPUT_PATH = Path(os.getenv('DEID_OUTPUT_PATH', './buffer_deid'))
+    DEID_FORWARD = os.getenv('DEID_FORWARD', '')  # host:port:AE_TITLE
+    DEID_WORKERS = int(os.getenv('DEID_WORKERS', 0)) or None
+    DEID_BATCH_SIZE = int(os.getenv('DEID_BATCH_SIZE', 32))
+    DEID_UID_SALT = os.getenv('DEID_UID_SALT', '')
+    # Stored instances waiting for de-identification; when full, C-STOREs wait for room
+    DEID_QUEUE_SIZE = int(os.getenv('DEID_QUEUE_SIZE', 1024))
+    REGISTRY_SNAPSHOT_PATH = Path(os.getenv('REGISTRY_SNAPSHOT_PATH', STORAGE_PATH / 'registry.json'))
+    REGISTRY_SNAPSHOT_INTERVAL = float(os.getenv('REGISTRY_SNAPSHOT_INTERVAL', 60))
+    # Same variable and default as the gateway API's volume cache retention
+    STUDY_RETENTION_HOURS = float(os.getenv('STUDY_RETENTION_HOURS', 72))
+    # new_study messages: json | msgpack (needs the msgpack package)
+    NOTIFICATION_ENCODING = os.getenv('NOTIFICATION_ENCODING', 'json')
+    # Larger study messages move their series manifests to files (referenced) or to chunk
+    # messages (chunked; only for a single consumer, a shared queue splits the chunks)
+    NOTIFICATION_INLINE_LIMIT = int(os.getenv('NOTIFICATION_INLINE_LIMIT', 256 * 1024))
+    NOTIFICATION_MANIFEST_MODE = os.getenv('NOTIFICATION_MANIFEST_MODE', 'referenced')
+    NOTIFICATION_CHUNK_SIZE = int(os.getenv('NOTIFICATION_CHUNK_SIZE', 2000))
+    # Instances arriving after a study was announced trigger one re-announcement once they stop for this long
+    NOTIFICATION_REPUBLISH_DELAY = float(os.getenv('NOTIFICATION_REPUBLISH_DELAY', 5))
+    # Failed announcements are retried after this delay, doubling per failure up to the maximum
+    NOTIFICATION_RETRY_DELAY = float(os.getenv('NOTIFICATION_RETRY_DELAY', 5))
+    NOTIFICATION_RETRY_MAX_DELAY = float(os.getenv('NOTIFICATION_RETRY_MAX_DELAY', 300))
 
 logging.basicConfig(
     level=logging.INFO,
@@ -32,127 +70,355 @@ class RabbitMQPublisher:
     def __init__(self):
         self.connection = None
         self.channel = None
+        # BlockingConnection is not thread-safe; association threads share it
+        self.lock = threading.RLock()
         
     def connect(self) -> bool:
+        import pika  # deferred: keeps SCP startup fast
         try:
-            self.connection = pika.BlockingConnection(
-                pika.ConnectionParameters(Config.RABBITMQ_HOST)
-            )
-            self.channel = self.connection.channel()
-            self.channel.queue_declare(queue=Config.RABBITMQ_QUEUE)
+            with self.lock:
+                self.connection = pika.BlockingConnection(
+                    pika.ConnectionParameters(Config.RABBITMQ_HOST)
+                )
+                self.channel = self.connection.channel()
+                self.channel.queue_declare(queue=Config.RABBITMQ_QUEUE)
             return True
         except Exception as e:
             logger.error(f"RabbitMQ connection failed: {e}")
             return False
-            
-    def publish_study(self, study_metadata: dict) -> bool:
+
+    @property
+    def connected(self) -> bool:
+        return bool(self.channel) and not self.connection.is_closed
+
+    def publish_study(self, study_uid: str, messages: list) -> bool:
+        """Publish the encoded (body, content_type, headers) messages of one study, in order"""
+        import pika
         try:
-            if not self.channel or self.connection.is_closed:
-                if not self.connect():
-                    return False
-                    
-            self.channel.basic_publish(
-                exchange='',
-                routing_key=Config.RABBITMQ_QUEUE,
-                body=json.dumps(study_metadata),
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # make message persistent
-                ))
-            logger.info(f"Published study to RabbitMQ: {study_metadata['study_uid']}")
+            with self.lock:
+                if not self.connected:
+                    if not self.connect():
+                        return False
+
+                for body, content_type, headers in messages:
+                    self.channel.basic_publish(
+                        exchange='',
+                        routing_key=Config.RABBITMQ_QUEUE,
+                        body=body,
+                        properties=pika.BasicProperties(
+                            content_type=content_type,
+                            correlation_id=study_uid,
+                            headers=headers,
+                            delivery_mode=2,  # make message persistent
+                        ))
+            logger.info(f"Published study to RabbitMQ: {study_uid} ({len(messages)} messages)")
             return True
         except Exception as e:
             logger.error(f"Failed to publish study: {e}")
             return False
             
     def close(self):
-        if self.connection and not self.connection.is_closed:
-            self.connection.close()
+        with self.lock:
+            if self.connection and not self.connection.is_closed:
+                self.connection.close()
 
 publisher = RabbitMQPublisher()
+deid_stage = DeidStage(Config.DEID_QUEUE_SIZE)
+registry = StudyRegistry(Config.STUDY_RETENTION_HOURS * 3600)
+NOTIFICATION_ENCODING = resolve_encoding(Config.NOTIFICATION_ENCODING)
+NOTIFICATION_MANIFEST_MODE = resolve_manifest_mode(Config.NOTIFICATION_MANIFEST_MODE)
+# StudyInstanceUID -> StudyRecord of announced studies that have since received instances
+late_studies = {}
+# StudyInstanceUID -> (failures, retry time) of studies whose announcement failed
+announce_retries = {}
+late_studies_lock = threading.Lock()
 
 def handle_echo(event):
     """Handle C-ECHO request (verification)"""
     requester = event.assoc.requestor.ae_title or "Unknown"
     logger.info(f"Received C-ECHO from {requester}")
     return 0x0000
-def is_study_complete(study_path: Path) -> bool:
-    """Check if all DICOM slices arrived using headers"""
-    dcm_files = list(study_path.glob("**/*.dcm"))
-    if not dcm_files:
-        return False
-    
+def volume_urls(study) -> dict:
+    """On-demand volume endpoints of the gateway API, keyed by SeriesInstanceUID"""
+    base = f"{Config.GATEWAY_API_URL}/dicom/studies/{study.study_uid}/series"
+    return {
+        series_uid: {
+            "volume": f"{base}/{series_uid}/volume",
+            "metadata": f"{base}/{series_uid}/volume/metadata",
+        }
+        for series_uid in sorted(study.series)
+    }
+
+def study_messages(study) -> list:
+    """
+    Encoded new_study messages for a registry StudyRecord (see notifications.py)
+
+    Pass a copy from registry.copy_study(): handle_store keeps appending to
+    the live record on other association threads.
+    """
+    message = study_notification(study, Config.STORAGE_PATH / study.study_uid, volume_urls(study))
+    return encode_messages(
+        message,
+        encoding=NOTIFICATION_ENCODING,
+        inline_limit=Config.NOTIFICATION_INLINE_LIMIT,
+        mode=NOTIFICATION_MANIFEST_MODE,
+        chunk_size=Config.NOTIFICATION_CHUNK_SIZE,
+    )
+
+def announce_study(study) -> bool:
+    """
+    Publish a study's notification; the instance is already stored, so never raise
+
+    A study that fails to publish goes back to pending and is retried by
+    republish_late_studies (or by reconcile_registry after a restart).
+    """
+    with tracer.span("rabbitmq.publish", **{"dicom.study_instance_uid": study.study_uid}) as publish:
+        try:
+            published = publisher.publish_study(study.study_uid, study_messages(registry.copy_study(study)))
+        except Exception as e:
+            publish.record_error(e)
+            logger.error(f"Failed to build notification for {study.study_uid}: {e}")
+            published = False
+        publish.set_attribute("published", published)
+    if published:
+        with late_studies_lock:
+            announce_retries.pop(study.study_uid, None)
+    else:
+        registry.mark_pending(study)
+        schedule_retry(study)
+    return published
+
+def schedule_retry(study):
+    """Queue a study for republish_late_studies, backing off exponentially per failed announcement"""
+    with late_studies_lock:
+        failures = announce_retries.get(study.study_uid, (0, 0.0))[0] + 1
+        delay = min(Config.NOTIFICATION_RETRY_DELAY * 2 ** min(failures - 1, 16), Config.NOTIFICATION_RETRY_MAX_DELAY)
+        announce_retries[study.study_uid] = (failures, time.time() + delay)
+        late_studies[study.study_uid] = study
+
+def republish_late_studies(force: bool = False) -> int:
+    """Re-announce studies whose late instances stopped arriving or whose announcement failed; force flushes all"""
+    now = time.time()
+    cutoff = now - Config.NOTIFICATION_REPUBLISH_DELAY
+    with late_studies_lock:
+        settled = [
+            s for s in late_studies.values()
+            if force or (s.last_seen <= cutoff and announce_retries.get(s.study_uid, (0, 0.0))[1] <= now)
+        ]
+        for study in settled:
+            del late_studies[study.study_uid]
+        # Pending again after a failed announcement, unlike studies with late instances
+        retrying = {study.study_uid for study in settled if study.study_uid in announce_retries}
+    for index, study in enumerate(settled):
+        # handle_store may have completed (and announced) a pending study meanwhile
+        if study.study_uid in retrying and not registry.mark_completed(study):
+            continue
+        logger.info(f"Re-announcing {study.study_uid}")
+        if not announce_study(study) and not publisher.connected:
+            # Broker unreachable: back off the rest of the pass instead of connecting for each
+            for remaining in settled[index + 1:]:
+                schedule_retry(remaining)
+            break
+    return len(settled)
+
+def republish_late_studies_periodically():
+    while True:
+        time.sleep(min(1.0, Config.NOTIFICATION_REPUBLISH_DELAY))
+        try:
+            republish_late_studies()
+        except Exception as e:
+            logger.error(f"Late study re-announcement failed: {e}")
+
+def write_instance(filepath: Path, data):
+    """
+    Write a stored instance under a temporary name, then rename it into place
+
+    Recovery and the gateway API read '*.dcm' from other threads and must
+    never see a partially written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{filepath.name}.", suffix='.tmp', dir=filepath.parent)
     try:
-        ds = pydicom.dcmread(dcm_files[0])
-        expected = getattr(ds, "NumberOfSeriesRelatedInstances", len(dcm_files))
-        return len(dcm_files) >= expected
-    except Exception as e:
-        logger.error(f"Study completion check failed: {e}")
-        return False
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 def handle_store(event):
     """Handle C-STORE request (DICOM file storage)"""
-    try:
-        ds = event.dataset
-        ds.file_meta = event.file_meta
-        
-        storage_path = (
-            Config.STORAGE_PATH / 
-            ds.StudyInstanceUID / 
-            ds.SeriesInstanceUID
-        )
-        storage_path.mkdir(parents=True, exist_ok=True)
-        
-        filepath = storage_path / f"{ds.SOPInstanceUID}.dcm"
-        ds.save_as(filepath, write_like_original=False)
-        
-        logger.info(f"Stored: {filepath}")
-        
-        # Check if study is complete
-        study_path = Config.STORAGE_PATH / ds.StudyInstanceUID
-        if is_study_complete(study_path):
-            study_metadata = {
-                "study_uid": ds.StudyInstanceUID,
-                "patient_id": ds.PatientID,
-                "modality": ds.Modality,
-                "slice_count": len(list(study_path.glob("**/*.dcm"))),
-                "storage_path": str(study_path)
-            }
-            publisher.publish_study(study_metadata)
-            
-        return 0x0000
-        
-    except Exception as e:
-        logger.error(f"Storage failed: {e}", exc_info=True)
-        return 0xC001
+    with tracer.span("c_store", **{"net.peer.ae_title": event.assoc.requestor.ae_title}) as span:
+        try:
+            with tracer.span("decode"):
+                ds = event.dataset
+                ds.file_meta = event.file_meta
+            span.set_attribute("dicom.sop_instance_uid", ds.SOPInstanceUID)
+            span.set_attribute("dicom.study_instance_uid", ds.StudyInstanceUID)
+
+            if registry.get(ds.StudyInstanceUID) is None:
+                # Unknown study: instances may already be on disk from before a crash or restart
+                with tracer.span("registry.recover"):
+                    recover_study(str(ds.StudyInstanceUID))
+
+            with tracer.span("filesystem.write"):
+                storage_path = (
+                    Config.STORAGE_PATH / 
+                    ds.StudyInstanceUID / 
+                    ds.SeriesInstanceUID
+                )
+                storage_path.mkdir(parents=True, exist_ok=True)
+
+                filepath = storage_path / f"{ds.SOPInstanceUID}.dcm"
+                # Encode in memory so the manifest checksum costs no second read
+                buffer = BytesIO()
+                ds.save_as(buffer, write_like_original=False)
+                data = buffer.getbuffer()
+                write_instance(filepath, data)
+
+            logger.info(f"Stored: {filepath}")
+            if deid_stage.enabled:
+                with tracer.span("deid.submit") as submit:
+                    submit.set_attribute("deid.queued", deid_stage.submit(filepath))
+
+            study = registry.add_instance(ds, len(data), zlib.crc32(data))
+
+            # Check if study is complete
+            with tracer.span("completion_check") as check:
+                complete = study.is_complete()
+                check.set_attribute("study.complete", complete)
+            if complete and registry.mark_completed(study):
+                announce_study(study)
+            elif study.completed:
+                # Already announced: batch late instances into one re-announcement
+                with late_studies_lock:
+                    late_studies[study.study_uid] = study
+
+            return 0x0000
+
+        except Exception as e:
+            span.record_error(e)
+            logger.error(f"Storage failed: {e}", exc_info=True)
+            return 0xC001
 
 def configure_tls() -> Optional[ssl.SSLContext]:
-    """Configure TLS for secure DICOM communication"""
+    """
+    Configure TLS for secure DICOM communication
+
+    Raises when TLS is enabled but cannot be set up, rather than serving plaintext.
+    """
     if not Config.TLS_ENABLED:
         return None
-        
+
     if not (Config.SERVER_CRT.exists() and Config.SERVER_KEY.exists()):
-        logger.error("TLS enabled but missing certificate files")
-        return None
+        raise FileNotFoundError(f"TLS enabled but missing certificate files in {Config.CERT_DIR}")
 
+    ciphers = resolve_ciphers(Config.TLS_CIPHER_POLICY)
     try:
         context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
         context.load_cert_chain(
             certfile=str(Config.SERVER_CRT),
             keyfile=str(Config.SERVER_KEY)
         )
-        context.set_ciphers('ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-GCM-SHA384')
-        return context
+        context.minimum_version = ssl.TLSVersion.TLSv1_2
+        context.set_ciphers(ciphers)
+        enable_session_resumption(context, Config.TLS_SESSION_TICKETS)
+        return instrument_context(context)
     except ssl.SSLError as e:
-        logger.error(f"TLS config failed: {e}")
-        return None
+        raise ValueError(f"TLS config failed: {e}") from e
+
+def connect_publisher():
+    """Initial RabbitMQ connection, off the SCP startup path"""
+    if not publisher.connect():
+        logger.warning("Initial RabbitMQ connection failed. Will retry during publishing.")
+
+def start_deid_stage():
+    """Start the optional de-identification stage from Config"""
+    if Config.DEID_MODE == 'off':
+        return
+    forward = None
+    if Config.DEID_FORWARD:
+        host, port, ae_title = Config.DEID_FORWARD.split(':')
+        forward = (host, int(port), ae_title)
+    deid_stage.start(
+        Config.DEID_MODE,
+        Config.DEID_OUTPUT_PATH,
+        forward=forward,
+        workers=Config.DEID_WORKERS,
+        batch_size=Config.DEID_BATCH_SIZE,
+        salt=Config.DEID_UID_SALT,
+    )
+
+def recover_study(study_uid: str) -> int:
+    """Register instances of a study already in STORAGE_PATH; returns the number of files read"""
+    recovered = 0
+    for path in (Config.STORAGE_PATH / study_uid).glob('*/*.dcm'):
+        try:
+            data = path.read_bytes()
+            ds = dcmread(BytesIO(data), stop_before_pixels=True)
+            # handle_store may have recorded this instance meanwhile; its values win
+            registry.add_instance(ds, len(data), zlib.crc32(data), replace=False)
+            recovered += 1
+        except Exception as e:
+            logger.warning(f"Skipping unreadable stored instance {path}: {e}")
+    if recovered:
+        logger.info(f"Recovered {recovered} stored instances of {study_uid}")
+    return recovered
+
+def reconcile_registry():
+    """Pick up instances stored after the last snapshot, and announce studies they complete"""
+    for study in registry.pending():
+        on_disk = sum(1 for _ in (Config.STORAGE_PATH / study.study_uid).glob('*/*.dcm'))
+        if on_disk > study.instance_count:
+            recover_study(study.study_uid)
+        # Complete but pending: stored after the snapshot, or its announcement failed
+        if study.is_complete() and registry.mark_completed(study):
+            announce_study(study)
+
+def restore_registry():
+    """Reload in-flight studies from the last snapshot, if any, then check them against STORAGE_PATH"""
+    if Config.REGISTRY_SNAPSHOT_PATH.exists():
+        try:
+            registry.restore(Config.REGISTRY_SNAPSHOT_PATH)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Registry restore failed: {e}")
+    # Off the startup path; studies not in the snapshot at all are recovered on their next instance
+    threading.Thread(target=reconcile_registry, daemon=True, name="registry-reconcile").start()
+
+def save_registry():
+    registry.prune()
+    try:
+        registry.snapshot(Config.REGISTRY_SNAPSHOT_PATH)
+    except OSError as e:
+        logger.error(f"Registry snapshot failed: {e}")
+
+def snapshot_registry_periodically():
+    while True:
+        time.sleep(Config.REGISTRY_SNAPSHOT_INTERVAL)
+        save_registry()
+
+def shutdown():
+    """Flush the workers, notifications and registry once the SCP has stopped"""
+    if Config.TLS_ENABLED:
+        logger.info(f"TLS handshakes: {handshake_stats.snapshot()}")
+    deid_stage.close()
+    # Before the snapshot, so a failed announcement is saved as pending
+    republish_late_studies(force=True)
+    save_registry()
+    publisher.close()
 
-def start_server():
-    """Start the DICOM SCP server"""
+def start_server(block: bool = True):
+    """
+    Start the DICOM SCP server
+
+    With block=False the SCP runs on a background thread and the
+    AssociationServer is returned; the caller stops it and then calls shutdown().
+    """
     ae = AE(ae_title=Config.AE_TITLE)
     ae.add_supported_context(Verification)
     ae.add_supported_context(CTImageStorage)
 
     # Ensure directories exist
-    Config.STORAGE_PATH.mkdir(exist_ok=True)
+    Config.STORAGE_PATH.mkdir(parents=True, exist_ok=True)
     Config.CERT_DIR.mkdir(exist_ok=True)
 
     ssl_context = configure_tls()
@@ -160,17 +426,30 @@ def start_server():
     logger.info(f"Starting DICOM SCP on port {Config.LISTEN_PORT} (TLS: {'Enabled' if ssl_context else 'Disabled'})")
     logger.info(f"RabbitMQ configured for host: {Config.RABBITMQ_HOST}")
 
+    start_deid_stage()
+    restore_registry()
+    threading.Thread(target=snapshot_registry_periodically, daemon=True, name="registry-snapshot").start()
+    threading.Thread(target=republish_late_studies_periodically, daemon=True, name="notify-republish").start()
+
+    # Initialize RabbitMQ connection without delaying the first association
+    threading.Thread(target=connect_publisher, daemon=True, name="rabbitmq-connect").start()
+
+    evt_handlers = [
+        (evt.EVT_C_ECHO, handle_echo),
+        (evt.EVT_C_STORE, handle_store)
+    ]
+    if not block:
+        return ae.start_server(
+            ('0.0.0.0', Config.LISTEN_PORT),
+            evt_handlers=evt_handlers,
+            ssl_context=ssl_context,
+            block=False
+        )
+
     try:
-        # Initialize RabbitMQ connection
-        if not publisher.connect():
-            logger.warning("Initial RabbitMQ connection failed. Will retry during publishing.")
-        
         ae.start_server(
             ('0.0.0.0', Config.LISTEN_PORT),
-            evt_handlers=[
-                (evt.EVT_C_ECHO, handle_echo),
-                (evt.EVT_C_STORE, handle_store)
-            ],
+            evt_handlers=evt_handlers,
             ssl_context=ssl_context,
             block=True
         )
@@ -179,7 +458,7 @@ def start_server():
     except Exception as e:
         logger.critical(f"Server failed: {e}", exc_info=True)
     finally:
-        publisher.close()
+        shutdown()
 
 if __name__ == "__main__":
     start_server()
\ No newline at end of file
@@ -0,0 +1,223 @@
+"""
+new_study notification schema
+
+Version 2 keeps the version 1 top-level fields (study_uid, patient_id,
+modality, slice_count, storage_path, volumes), adds an optional
+patient_name and a manifest per series, so consumers can fetch and order
+the files without listing directories or reading DICOM headers:
+
+    {"schema": "dicom-gw.new_study", "schema_version": 2, "type": "study", ...,
+     "series": [{"series_uid", "modality", "directory", "instance_count",
+                 "manifest": {"sop_instance_uids", "files", "sizes",
+                              "instance_numbers", "positions", "crc32"}}]}
+
+Manifest columns are parallel lists sorted by slice position (then
+InstanceNumber); "files" are relative to "directory", "positions" is null
+where the instance has no geometry and "crc32" is 0 where no checksum was
+recorded. When the encoded message exceeds the inline limit, each manifest
+is replaced by either
+
+    "manifest_ref": {...}  -- a manifest file next to the series directories
+    "manifest_chunks": n   -- n "series_manifest" messages published first
+
+All messages of a study carry its study_uid as AMQP correlation_id. Chunks
+are only reassembled reliably by a single consumer of the queue, as
+RabbitMQ deals a shared work queue out round-robin; "referenced" is the
+default for that reason.
+
+Messages are JSON, or msgpack when that encoding is selected and installed.
+
+A study is announced once, when it completes. Instances that arrive later
+produce one re-announcement of the whole study after they stop arriving;
+the latest "study" message for a study_uid supersedes earlier ones.
+"""
+import os
+import json
+import math
+import zlib
+import logging
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = 'dicom-gw.new_study'
+SCHEMA_VERSION = 2
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+CONTENT_TYPES = {'json': JSON, 'msgpack': MSGPACK}
+
+MANIFEST_MODES = ('referenced', 'chunked')
+
+
+def resolve_encoding(name: str) -> str:
+    """Validate an encoding name, falling back to JSON when msgpack is not installed"""
+    name = name.lower()
+    if name not in CONTENT_TYPES:
+        raise ValueError(f"Unknown notification encoding: {name}")
+    if name == 'msgpack':
+        try:
+            import msgpack  # noqa: F401
+        except ImportError:
+            logger.warning("msgpack is not installed; publishing notifications as JSON")
+            return 'json'
+    return name
+
+
+def resolve_manifest_mode(name: str) -> str:
+    name = name.lower()
+    if name not in MANIFEST_MODES:
+        raise ValueError(f"Unknown manifest mode: {name}")
+    return name
+
+
+def encode(message: dict, encoding: str = 'json') -> tuple:
+    """Returns (body, content_type)"""
+    if encoding == 'msgpack':
+        import msgpack
+        return msgpack.packb(message, use_bin_type=True), MSGPACK
+    return json.dumps(message, separators=(',', ':')).encode(), JSON
+
+
+def decode(body: bytes, content_type: str = JSON) -> dict:
+    if content_type == MSGPACK:
+        import msgpack
+        return msgpack.unpackb(body, raw=False)
+    return json.loads(body)
+
+
+def headers(message: dict) -> dict:
+    """AMQP headers, so consumers can route on schema and type without decoding the body"""
+    return {"schema": SCHEMA, "schema_version": SCHEMA_VERSION, "type": message["type"]}
+
+
+def series_manifest(series) -> dict:
+    """Columnar manifest of a registry SeriesRecord, in volume order"""
+    uids = series.instance_uids()
+    positions = [None if math.isnan(p) else p for p in series.positions]
+
+    def sort_key(i):
+        # Instances without geometry go last, in InstanceNumber order
+        return (positions[i] is None, positions[i] or 0.0, series.instance_numbers[i])
+
+    order = sorted(range(len(uids)), key=sort_key)
+    return {
+        "sop_instance_uids": [uids[i] for i in order],
+        "files": [f"{uids[i]}.dcm" for i in order],
+        "sizes": [series.sizes[i] for i in order],
+        "instance_numbers": [series.instance_numbers[i] for i in order],
+        "positions": [positions[i] for i in order],
+        "crc32": [series.checksums[i] for i in order],
+    }
+
+
+def build_notification(study_uid: str, patient_id, modality: str, slice_count: int,
+                       storage_path=None, volumes: dict = None, series: list = (),
+                       patient_name: str = None) -> dict:
+    message = {
+        "schema": SCHEMA,
+        "schema_version": SCHEMA_VERSION,
+        "type": "study",
+        "study_uid": study_uid,
+        "patient_id": patient_id,
+        "modality": modality,
+        "slice_count": slice_count,
+        "storage_path": str(storage_path) if storage_path is not None else None,
+        "volumes": volumes or {},
+        "series": list(series),
+    }
+    if patient_name is not None:
+        message["patient_name"] = str(patient_name)
+    return message
+
+
+def study_notification(study, storage_path: Path, volumes: dict = None) -> dict:
+    """
+    Notification for a registry StudyRecord, manifests inline
+
+    Reads the record without locking; pass StudyRegistry.copy_study() of a
+    study that may still be receiving instances.
+    """
+    series = [
+        {
+            "series_uid": record.series_uid,
+            "modality": record.modality,
+            "directory": str(storage_path / record.series_uid),
+            "instance_count": len(record),
+            "manifest": series_manifest(record),
+        }
+        for _, record in sorted(study.series.items())
+    ]
+    return build_notification(
+        study.study_uid, study.patient_id, study.modality, study.instance_count,
+        storage_path, volumes, series,
+    )
+
+
+def _chunk_messages(message: dict, entry: dict, chunk_size: int) -> list:
+    manifest = entry.pop("manifest")
+    count = entry["instance_count"]
+    offsets = range(0, count, chunk_size)
+    entry["manifest_chunks"] = len(offsets)
+    return [
+        {
+            "schema": SCHEMA,
+            "schema_version": SCHEMA_VERSION,
+            "type": "series_manifest",
+            "study_uid": message["study_uid"],
+            "series_uid": entry["series_uid"],
+            "directory": entry["directory"],
+            "chunk": index,
+            "chunks": len(offsets),
+            "offset": offset,
+            "manifest": {column: values[offset:offset + chunk_size] for column, values in manifest.items()},
+        }
+        for index, offset in enumerate(offsets)
+    ]
+
+
+def _write_manifest(entry: dict, storage_path: Path, encoding: str):
+    """Write the manifest next to the series directories and reference it; atomic replace"""
+    body, content_type = encode(entry.pop("manifest"), encoding)
+    path = Path(storage_path) / f"{entry['series_uid']}.manifest.{encoding}"
+    # Concurrent announcements of a study write the same manifest: unique temp file each
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix='.tmp', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    entry["manifest_ref"] = {
+        "path": str(path),
+        "content_type": content_type,
+        "size": len(body),
+        "crc32": zlib.crc32(body),
+    }
+
+
+def encode_messages(message: dict, encoding: str = 'json', inline_limit: int = 256 * 1024,
+                    mode: str = 'referenced', chunk_size: int = 2000) -> list:
+    """
+    Encode a study notification for publishing, in publish order
+
+    Returns [(body, content_type, headers)]. Manifests stay inline while the
+    encoded study message fits in inline_limit bytes; otherwise manifests
+    are written to files, or chunk messages precede the study message.
+    """
+    body, content_type = encode(message, encoding)
+    if len(body) <= inline_limit:
+        return [(body, content_type, headers(message))]
+
+    messages = []
+    for entry in message["series"]:
+        if "manifest" not in entry:
+            continue
+        if mode == 'chunked':
+            messages.extend(_chunk_messages(message, entry, chunk_size))
+        else:
+            _write_manifest(entry, message["storage_path"], encoding)
+    messages.append(message)
+    return [encode(m, encoding) + (headers(m),) for m in messages]
@@ -0,0 +1,307 @@
+import os
+import sys
+import json
+import math
+import time
+import base64
+import hashlib
+import logging
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 2
+NO_POSITION = math.nan
+
+
+def _uid_hash(uid: str) -> int:
+    return int.from_bytes(hashlib.blake2b(uid.encode(), digest_size=8).digest(), 'little')
+
+
+def slice_position(ds) -> float:
+    """Distance along the slice normal, the natural sort key for a volume"""
+    try:
+        ipp = [float(v) for v in ds.ImagePositionPatient]
+        iop = [float(v) for v in ds.ImageOrientationPatient]
+    except (AttributeError, TypeError, ValueError):
+        return NO_POSITION
+    normal = (
+        iop[1] * iop[5] - iop[2] * iop[4],
+        iop[2] * iop[3] - iop[0] * iop[5],
+        iop[0] * iop[4] - iop[1] * iop[3],
+    )
+    return sum(p * n for p, n in zip(ipp, normal))
+
+
+class SeriesRecord:
+    """Instances of one series, stored column-wise in typed arrays"""
+
+    __slots__ = (
+        'series_uid', 'modality', 'sop_uids', 'sop_hashes', 'instance_numbers', 'positions', 'sizes', 'checksums',
+        'sorted_hashes', 'sorted_rows',
+    )
+
+    def __init__(self, series_uid: str, modality: str):
+        self.series_uid = series_uid
+        self.modality = modality
+        # SOP Instance UIDs are unique, so interning them buys nothing; keep one NUL-separated blob
+        self.sop_uids = bytearray()
+        self.sop_hashes = array('Q')
+        self.instance_numbers = array('i')
+        self.positions = array('d')
+        self.sizes = array('Q')
+        # CRC-32 of the stored file
+        self.checksums = array('I')
+        # Duplicate lookup: sop_hashes in sorted order and the row each one is at
+        self.sorted_hashes = array('Q')
+        self.sorted_rows = array('I')
+
+    def __len__(self) -> int:
+        return len(self.sop_hashes)
+
+    def add(
+        self, sop_uid: str, instance_number: int, position: float, size: int, checksum: int = 0, replace: bool = True,
+    ) -> bool:
+        """
+        Append an instance; returns False when the SOP Instance UID was already recorded
+
+        A re-sent instance updates the size and checksum of its row, unless replace is False.
+        """
+        uid_hash = _uid_hash(sop_uid)
+        i = bisect_left(self.sorted_hashes, uid_hash)
+        if i < len(self.sorted_hashes) and self.sorted_hashes[i] == uid_hash:
+            if replace:
+                row = self.sorted_rows[i]
+                self.sizes[row] = size
+                self.checksums[row] = checksum
+            return False
+        # O(log n) search; the insert is a memmove of a few bytes per instance
+        self.sorted_hashes.insert(i, uid_hash)
+        self.sorted_rows.insert(i, len(self.sop_hashes))
+        self.sop_uids += sop_uid.encode() + b'\0'
+        self.sop_hashes.append(uid_hash)
+        self.instance_numbers.append(instance_number)
+        self.positions.append(position)
+        self.sizes.append(size)
+        self.checksums.append(checksum)
+        return True
+
+    def index(self):
+        """Rebuild the duplicate lookup from sop_hashes (after restoring the columns)"""
+        rows = sorted(range(len(self.sop_hashes)), key=self.sop_hashes.__getitem__)
+        self.sorted_rows = array('I', rows)
+        self.sorted_hashes = array('Q', [self.sop_hashes[row] for row in rows])
+
+    def instance_uids(self) -> list:
+        return self.sop_uids.decode().split('\0')[:-1]
+
+    def copy(self) -> 'SeriesRecord':
+        """Detached copy of the columns (memcpy); take it under the registry lock"""
+        series = SeriesRecord(self.series_uid, self.modality)
+        series.sop_uids = self.sop_uids[:]
+        series.sop_hashes = self.sop_hashes[:]
+        series.instance_numbers = self.instance_numbers[:]
+        series.positions = self.positions[:]
+        series.sizes = self.sizes[:]
+        series.checksums = self.checksums[:]
+        series.sorted_hashes = self.sorted_hashes[:]
+        series.sorted_rows = self.sorted_rows[:]
+        return series
+
+
+class StudyRecord:
+    __slots__ = ('study_uid', 'patient_id', 'modality', 'expected', 'series', 'first_seen', 'last_seen', 'completed')
+
+    def __init__(self, study_uid: str, patient_id: str, modality: str):
+        self.study_uid = study_uid
+        self.patient_id = patient_id
+        self.modality = modality
+        self.expected = 0
+        self.series = {}
+        self.first_seen = self.last_seen = time.time()
+        self.completed = 0.0
+
+    @property
+    def instance_count(self) -> int:
+        return sum(len(series) for series in self.series.values())
+
+    def is_complete(self) -> bool:
+        """Same rule as the old header check: NumberOfSeriesRelatedInstances of the first instance"""
+        return self.instance_count >= (self.expected or self.instance_count)
+
+    def copy(self) -> 'StudyRecord':
+        """Detached copy of the study and its series; take it under the registry lock"""
+        study = StudyRecord(self.study_uid, self.patient_id, self.modality)
+        study.expected = self.expected
+        study.first_seen = self.first_seen
+        study.last_seen = self.last_seen
+        study.completed = self.completed
+        study.series = {uid: series.copy() for uid, series in self.series.items()}
+        return study
+
+
+class StudyRegistry:
+    """In-flight and recently completed studies, kept compact for tens of thousands of studies"""
+
+    def __init__(self, retention_seconds: float = 86400):
+        self.lock = threading.Lock()
+        self.snapshot_lock = threading.Lock()
+        self.studies = {}
+        self.retention_seconds = retention_seconds
+
+    def __len__(self) -> int:
+        return len(self.studies)
+
+    def get(self, study_uid: str):
+        return self.studies.get(study_uid)
+
+    def add_instance(self, ds, size: int = 0, checksum: int = 0, replace: bool = True) -> StudyRecord:
+        """
+        Record a stored instance and return its (updated) study
+
+        replace=False only adds instances not recorded yet (recovery from disk).
+        """
+        study_uid = sys.intern(str(ds.StudyInstanceUID))
+        series_uid = sys.intern(str(ds.SeriesInstanceUID))
+        modality = sys.intern(str(getattr(ds, 'Modality', '')))
+        try:
+            instance_number = int(getattr(ds, 'InstanceNumber', 0) or 0)
+        except (TypeError, ValueError):
+            instance_number = 0
+        position = slice_position(ds)
+
+        with self.lock:
+            study = self.studies.get(study_uid)
+            if study is None:
+                study = self.studies[study_uid] = StudyRecord(
+                    study_uid, sys.intern(str(getattr(ds, 'PatientID', ''))), modality
+                )
+                expected = getattr(ds, 'NumberOfSeriesRelatedInstances', None)
+                study.expected = int(expected) if expected else 0
+            series = study.series.get(series_uid)
+            if series is None:
+                series = study.series[series_uid] = SeriesRecord(series_uid, modality)
+            series.add(str(ds.SOPInstanceUID), instance_number, position, size, checksum, replace)
+            study.last_seen = time.time()
+            return study
+
+    def copy_study(self, study: StudyRecord) -> StudyRecord:
+        """Consistent copy of a study that add_instance can keep appending to meanwhile"""
+        with self.lock:
+            return study.copy()
+
+    def pending(self) -> list:
+        """Studies not yet completed"""
+        with self.lock:
+            return [study for study in self.studies.values() if not study.completed]
+
+    def mark_completed(self, study: StudyRecord) -> bool:
+        """Returns True for the first caller only, so a study is announced once"""
+        with self.lock:
+            if study.completed:
+                return False
+            study.completed = time.time()
+            return True
+
+    def mark_pending(self, study: StudyRecord):
+        """Undo mark_completed when the announcement failed, so snapshots keep it pending"""
+        with self.lock:
+            study.completed = 0.0
+
+    def prune(self, now: float = None) -> int:
+        """Forget studies idle for longer than the retention window"""
+        cutoff = (now or time.time()) - self.retention_seconds
+        with self.lock:
+            stale = [uid for uid, study in self.studies.items() if study.last_seen < cutoff]
+            for uid in stale:
+                del self.studies[uid]
+        return len(stale)
+
+    # ===== Snapshot / restore =====
+    def snapshot(self, path: Path):
+        """Write the registry as versioned JSON with arrays as base64; atomic replace"""
+        # Copy the columns under the lock (memcpy), encode after releasing it
+        with self.lock:
+            copies = [study.copy() for study in self.studies.values()]
+        studies = [
+            {
+                "uid": study.study_uid,
+                "patient_id": study.patient_id,
+                "modality": study.modality,
+                "expected": study.expected,
+                "first_seen": study.first_seen,
+                "last_seen": study.last_seen,
+                "completed": study.completed,
+                "series": [
+                    {
+                        "uid": series.series_uid,
+                        "modality": series.modality,
+                        "sop_uids": base64.b64encode(series.sop_uids).decode(),
+                        "sop_hashes": base64.b64encode(series.sop_hashes.tobytes()).decode(),
+                        "instance_numbers": series.instance_numbers.tolist(),
+                        "positions": base64.b64encode(series.positions.tobytes()).decode(),
+                        "sizes": series.sizes.tolist(),
+                        "checksums": series.checksums.tolist(),
+                    }
+                    for series in study.series.values()
+                ],
+            }
+            for study in copies
+        ]
+        payload = {"version": SNAPSHOT_VERSION, "byteorder": sys.byteorder, "studies": studies}
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Periodic and shutdown snapshots can overlap: unique temp file, one writer at a time
+        with self.snapshot_lock:
+            fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix='.tmp', dir=path.parent)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(payload, f, separators=(',', ':'))
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        logger.info(f"Registry snapshot: {len(studies)} studies -> {path}")
+
+    def restore(self, path: Path) -> int:
+        """Load a snapshot written by snapshot(); returns the number of studies restored"""
+        with open(path) as f:
+            payload = json.load(f)
+        if payload.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported registry snapshot version: {payload.get('version')}")
+        swap = payload.get("byteorder") != sys.byteorder
+
+        def typed(code, b64):
+            values = array(code)
+            values.frombytes(base64.b64decode(b64))
+            if swap:
+                values.byteswap()
+            return values
+
+        studies = {}
+        for s in payload["studies"]:
+            study = StudyRecord(sys.intern(s["uid"]), sys.intern(s["patient_id"]), sys.intern(s["modality"]))
+            study.expected = s["expected"]
+            study.first_seen = s["first_seen"]
+            study.last_seen = s["last_seen"]
+            study.completed = s["completed"]
+            for r in s["series"]:
+                series = SeriesRecord(sys.intern(r["uid"]), sys.intern(r["modality"]))
+                series.sop_uids = bytearray(base64.b64decode(r["sop_uids"]))
+                series.sop_hashes = typed('Q', r["sop_hashes"])
+                series.instance_numbers = array('i', r["instance_numbers"])
+                series.positions = typed('d', r["positions"])
+                series.sizes = array('Q', r["sizes"])
+                series.checksums = array('I', r["checksums"])
+                series.index()
+                study.series[series.series_uid] = series
+            studies[study.study_uid] = study
+
+        with self.lock:
+            self.studies.update(studies)
+        logger.info(f"Registry restored: {len(studies)} studies from {path}")
+        return len(studies)
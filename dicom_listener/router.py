@@ -0,0 +1,370 @@
+import os
+import time
+import zlib
+import bisect
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+from pydicom.filereader import read_dataset
+from pydicom.tag import Tag
+from pynetdicom import AE, evt, DEFAULT_TRANSFER_SYNTAXES
+from pynetdicom.dimse_primitives import C_STORE
+from pynetdicom.sop_class import Verification, CTImageStorage
+
+
+class Config:
+    LISTEN_PORT = int(os.getenv('ROUTER_PORT', 11112))
+    AE_TITLE = os.getenv('ROUTER_AE_TITLE', 'DICOM_ROUTER')
+    # Comma separated host:port[:AE_TITLE] entries
+    BACKENDS = os.getenv('ROUTER_BACKENDS', 'localhost:11113,localhost:11114,localhost:11115')
+    # Optional file with one backend per line, re-read on every health check
+    BACKENDS_FILE = os.getenv('ROUTER_BACKENDS_FILE')
+    BACKEND_AE_TITLE = os.getenv('ROUTER_BACKEND_AE_TITLE', 'DICOM_GATEWAY')
+    VIRTUAL_NODES = int(os.getenv('ROUTER_VIRTUAL_NODES', 128))
+    # Concurrent associations per backend, so studies sharing a backend are not serialised
+    BACKEND_ASSOCIATIONS = int(os.getenv('ROUTER_BACKEND_ASSOCIATIONS', 4))
+    HEALTH_CHECK_INTERVAL = float(os.getenv('ROUTER_HEALTH_CHECK_INTERVAL', 10))
+    # How long a study stays pinned to its backend after its last instance
+    STUDY_AFFINITY_TTL = float(os.getenv('ROUTER_STUDY_AFFINITY_TTL', 3600))
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+
+STUDY_INSTANCE_UID = Tag(0x0020, 0x000D)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+def parse_backends(spec: str) -> list:
+    """Parse 'host:port[:AE],...' into (host, port, ae_title) tuples"""
+    backends = []
+    for entry in spec.replace('\n', ',').split(','):
+        entry = entry.strip()
+        if not entry or entry.startswith('#'):
+            continue
+        parts = entry.split(':')
+        ae_title = parts[2] if len(parts) > 2 else Config.BACKEND_AE_TITLE
+        backends.append((parts[0], int(parts[1]), ae_title))
+    return backends
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, backends=(), virtual_nodes: int = Config.VIRTUAL_NODES):
+        self.virtual_nodes = virtual_nodes
+        self._keys = []
+        self._nodes = {}
+        self.backends = set()
+        for backend in backends:
+            self.add(backend)
+
+    def add(self, backend):
+        for i in range(self.virtual_nodes):
+            point = _hash(f"{backend[0]}:{backend[1]}#{i}")
+            if point not in self._nodes:
+                bisect.insort(self._keys, point)
+            self._nodes[point] = backend
+        self.backends.add(backend)
+
+    def remove(self, backend):
+        for i in range(self.virtual_nodes):
+            point = _hash(f"{backend[0]}:{backend[1]}#{i}")
+            if self._nodes.get(point) == backend:
+                del self._nodes[point]
+                self._keys.pop(bisect.bisect_left(self._keys, point))
+        self.backends.discard(backend)
+
+    def __contains__(self, backend) -> bool:
+        return backend in self.backends
+
+    def get(self, key: str):
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._nodes[self._keys[index]]
+
+
+def peek_study_uid(data: bytes, transfer_syntax) -> str:
+    """StudyInstanceUID of an encoded dataset, parsing only the elements up to it"""
+    is_implicit_VR, is_little_endian = transfer_syntax.is_implicit_VR, transfer_syntax.is_little_endian
+    if transfer_syntax.is_deflated:
+        data = zlib.decompress(data, -zlib.MAX_WBITS)
+        is_implicit_VR, is_little_endian = False, True
+    ds = read_dataset(
+        BytesIO(data), is_implicit_VR, is_little_endian,
+        stop_when=lambda tag, vr, length: tag > STUDY_INSTANCE_UID,
+    )
+    return str(ds.StudyInstanceUID)
+
+
+def send_encoded(assoc, context_id: int, sop_class: str, sop_instance: str, data: bytes):
+    """
+    C-STORE a dataset in the encoding it was received in
+
+    Returns the status Dataset, or None when the backend did not respond.
+
+    Association.send_c_store only accepts a Dataset (re-encoded) or a file path,
+    so this issues the request on the DIMSE provider the same way it does.
+    """
+    req = C_STORE()
+    req.MessageID = 1
+    req.AffectedSOPClassUID = sop_class
+    req.AffectedSOPInstanceUID = sop_instance
+    req.Priority = 2
+    req.DataSet = BytesIO(data)
+
+    # Pause the reactor so it does not consume the response
+    assoc._reactor_checkpoint.clear()
+    while not assoc._is_paused:
+        time.sleep(0.0001)
+    try:
+        assoc.dimse.send_msg(req, context_id)
+        _, rsp = assoc.dimse.get_msg(block=True)
+    finally:
+        assoc._reactor_checkpoint.set()
+
+    if rsp is None:
+        assoc._handle_no_response()
+        return None
+    return assoc._check_received_status(rsp)
+
+
+def forward(assoc, event):
+    """Forward a received C-STORE unchanged, or re-encoded when the backend lacks its transfer syntax"""
+    request = event.request
+    transfer_syntax = event.context.transfer_syntax
+    for context in assoc.accepted_contexts:
+        if context.abstract_syntax == request.AffectedSOPClassUID and context.transfer_syntax[0] == transfer_syntax:
+            return send_encoded(
+                assoc, context.context_id, request.AffectedSOPClassUID, request.AffectedSOPInstanceUID,
+                request.DataSet.getvalue(),
+            )
+    ds = event.dataset
+    ds.file_meta = event.file_meta
+    return assoc.send_c_store(ds)
+
+
+class BackendPool:
+    """Up to `size` reusable SCU associations to a single backend gateway"""
+
+    def __init__(self, backend, size: int = None):
+        self.backend = backend
+        # Bounds concurrent sends; each holds its own association
+        self.slots = threading.BoundedSemaphore(size or Config.BACKEND_ASSOCIATIONS)
+        self.lock = threading.Lock()
+        self.idle = []
+        self.closed = False
+        self.ae = AE(ae_title=Config.AE_TITLE)
+        # One context per transfer syntax, so instances can be forwarded in the encoding they arrived in
+        for transfer_syntax in DEFAULT_TRANSFER_SYNTAXES:
+            self.ae.add_requested_context(CTImageStorage, transfer_syntax)
+
+    def _associate(self):
+        host, port, ae_title = self.backend
+        assoc = self.ae.associate(host, port, ae_title=ae_title)
+        if not assoc.is_established:
+            raise ConnectionError(f"Association rejected by {host}:{port}")
+        return assoc
+
+    def _checkin(self, assoc):
+        with self.lock:
+            if not self.closed:
+                self.idle.append(assoc)
+                return
+        assoc.release()
+
+    def send(self, event) -> int:
+        """Forward the C-STORE of an EVT_C_STORE event; returns its status"""
+        with self.slots:
+            with self.lock:
+                assoc = self.idle.pop() if self.idle else None
+            for attempt in range(2):
+                if assoc is None or not assoc.is_established:
+                    assoc = self._associate()
+                try:
+                    status = forward(assoc, event)
+                except Exception:
+                    assoc.abort()
+                    raise
+                if status:
+                    self._checkin(assoc)
+                    return status.Status
+                # Empty status means the association dropped; reconnect once
+                assoc = None
+            raise ConnectionError(f"No response from {self.backend[0]}:{self.backend[1]}")
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for assoc in idle:
+            if assoc.is_established:
+                assoc.release()
+
+
+class StudyRouter:
+    """Route instances to backends by StudyInstanceUID"""
+
+    def __init__(self, backends):
+        self.lock = threading.Lock()
+        self.configured = set(backends)
+        self.ring = HashRing(backends)
+        self.pools = {}
+        # StudyInstanceUID -> (backend, last seen), oldest first
+        self.affinity = OrderedDict()
+
+    def backend_for(self, study_uid: str):
+        """Pick a backend, keeping in-flight studies where they started"""
+        with self.lock:
+            now = time.monotonic()
+            while self.affinity:
+                uid, (_, seen) = next(iter(self.affinity.items()))
+                if now - seen <= Config.STUDY_AFFINITY_TTL:
+                    break
+                del self.affinity[uid]
+
+            pinned = self.affinity.get(study_uid)
+            backend = pinned[0] if pinned and pinned[0] in self.ring else self.ring.get(study_uid)
+            if backend is not None:
+                self.affinity[study_uid] = (backend, now)
+                self.affinity.move_to_end(study_uid)
+            return backend
+
+    def pool(self, backend) -> BackendPool:
+        with self.lock:
+            if backend not in self.pools:
+                self.pools[backend] = BackendPool(backend)
+            return self.pools[backend]
+
+    def set_backends(self, backends):
+        """Replace the configured backend set and rebalance the ring"""
+        backends = set(backends)
+        with self.lock:
+            for backend in self.configured - backends:
+                self.ring.remove(backend)
+                logger.info(f"Backend removed: {backend[0]}:{backend[1]}")
+            for backend in backends - self.configured:
+                self.ring.add(backend)
+                logger.info(f"Backend added: {backend[0]}:{backend[1]}")
+            self.configured = backends
+            removed = [self.pools.pop(b) for b in list(self.pools) if b not in backends]
+        for pool in removed:
+            pool.close()
+
+    def mark(self, backend, healthy: bool):
+        with self.lock:
+            in_ring = backend in self.ring
+            if healthy and not in_ring and backend in self.configured:
+                self.ring.add(backend)
+                logger.info(f"Backend back online: {backend[0]}:{backend[1]}")
+            elif not healthy and in_ring:
+                self.ring.remove(backend)
+                logger.warning(f"Backend offline, rebalancing: {backend[0]}:{backend[1]}")
+
+    def close(self):
+        with self.lock:
+            pools = list(self.pools.values())
+        for pool in pools:
+            pool.close()
+
+
+def check_backend(backend) -> bool:
+    """C-ECHO a backend"""
+    ae = AE(ae_title=Config.AE_TITLE)
+    ae.add_requested_context(Verification)
+    ae.acse_timeout = 5
+    host, port, ae_title = backend
+    assoc = ae.associate(host, port, ae_title=ae_title)
+    if not assoc.is_established:
+        return False
+    status = assoc.send_c_echo()
+    assoc.release()
+    return bool(status) and status.Status == 0x0000
+
+
+def monitor_backends(router: StudyRouter, stop: threading.Event):
+    """Refresh the backend list and health until stopped"""
+    while not stop.wait(Config.HEALTH_CHECK_INTERVAL):
+        if Config.BACKENDS_FILE:
+            try:
+                router.set_backends(parse_backends(Path(Config.BACKENDS_FILE).read_text()))
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to reload backends: {e}")
+        for backend in list(router.configured):
+            router.mark(backend, check_backend(backend))
+
+
+def make_store_handler(router: StudyRouter):
+    def handle_store(event):
+        """Forward C-STORE to the backend owning the study"""
+        try:
+            # Only the StudyInstanceUID is parsed; the dataset is forwarded as received
+            study_uid = peek_study_uid(event.request.DataSet.getvalue(), event.context.transfer_syntax)
+            backend = router.backend_for(study_uid)
+            if backend is None:
+                logger.error("No backend available")
+                return 0xA700
+
+            status = router.pool(backend).send(event)
+            logger.info(f"Routed {event.request.AffectedSOPInstanceUID} to {backend[0]}:{backend[1]}")
+            return status
+        except Exception as e:
+            logger.error(f"Routing failed: {e}", exc_info=True)
+            return 0xC001
+    return handle_store
+
+
+def handle_echo(event):
+    """Handle C-ECHO request (verification)"""
+    return 0x0000
+
+
+def start_router(backends=None, port: Optional[int] = None, block: bool = True):
+    """Start the routing SCP; returns (server, router, stop event) when not blocking"""
+    if backends is None:
+        source = Path(Config.BACKENDS_FILE).read_text() if Config.BACKENDS_FILE else Config.BACKENDS
+        backends = parse_backends(source)
+    router = StudyRouter(backends)
+
+    ae = AE(ae_title=Config.AE_TITLE)
+    ae.add_supported_context(Verification)
+    ae.add_supported_context(CTImageStorage)
+
+    stop = threading.Event()
+    threading.Thread(
+        target=monitor_backends, args=(router, stop), daemon=True, name="router-health"
+    ).start()
+
+    port = port or Config.LISTEN_PORT
+    logger.info(f"Starting DICOM router on port {port} -> {len(backends)} backends")
+    handlers = [
+        (evt.EVT_C_ECHO, handle_echo),
+        (evt.EVT_C_STORE, make_store_handler(router)),
+    ]
+    if not block:
+        server = ae.start_server(('0.0.0.0', port), evt_handlers=handlers, block=False)
+        return server, router, stop
+
+    try:
+        ae.start_server(('0.0.0.0', port), evt_handlers=handlers, block=True)
+    except KeyboardInterrupt:
+        logger.info("Router stopped by user")
+    finally:
+        stop.set()
+        router.close()
+
+
+if __name__ == "__main__":
+    start_router()
@@ -0,0 +1,57 @@
+"""Dataset, event and port helpers shared by the listener tests"""
+import socket
+from types import SimpleNamespace
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import generate_uid, ExplicitVRLittleEndian
+from pynetdicom.sop_class import CTImageStorage
+
+
+def free_port() -> int:
+    """An unused localhost TCP port"""
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def make_instance(study_uid, series_uid, number=1, sop_uid=None, expected=None):
+    """
+    Pixel-less CT instance
+
+    Carries geometry for slice ordering, plus the PHI, private tag and
+    nested sequence the de-identification tests look for.
+    """
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.file_meta.MediaStorageSOPClassUID = CTImageStorage
+    ds.file_meta.MediaStorageSOPInstanceUID = sop_uid or generate_uid()
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = study_uid
+    ds.SeriesInstanceUID = series_uid
+    ds.PatientName = "Doe^Jane"
+    ds.PatientID = "MRN-0042"
+    ds.PatientBirthDate = "19800101"
+    ds.InstitutionName = "General Hospital"
+    ds.StudyDate = "20240102"
+    ds.Modality = "CT"
+    ds.InstanceNumber = number
+    ds.ImagePositionPatient = [0.0, 0.0, -2.5 * number]
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    if expected:
+        ds.NumberOfSeriesRelatedInstances = expected
+    ds.add_new(0x00091001, "LO", "vendor secret")
+    ref = Dataset()
+    ref.ReferencedSOPClassUID = ds.SOPClassUID
+    ref.ReferencedSOPInstanceUID = "1.2.3.4.5"
+    ref.PatientName = "Nested^Name"
+    ds.ReferencedImageSequence = [ref]
+    return ds
+
+
+def store_event(ds):
+    """Minimal EVT_C_STORE event for calling a handle_store directly"""
+    return SimpleNamespace(
+        dataset=ds, file_meta=ds.file_meta, assoc=SimpleNamespace(requestor=SimpleNamespace(ae_title="TEST")),
+    )
+
@@ -0,0 +1,122 @@
+import threading
+import pytest
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from pydicom import dcmread
+from pydicom.uid import generate_uid
+
+from deid import compile_profile, deidentify, DeidStage
+from tests.helpers import make_instance
+
+RULES = compile_profile()
+SALT = "test-salt"
+
+
+def test_profile_strips_phi_including_sequences():
+    ds = deidentify(make_instance(generate_uid(), generate_uid()), RULES, SALT)
+
+    assert str(ds.PatientName) == "ANONYMOUS"
+    assert ds.PatientID not in ("", "MRN-0042")
+    assert ds.PatientBirthDate == ""
+    assert ds.StudyDate == ""
+    assert "InstitutionName" not in ds
+    assert 0x00091001 not in ds
+    item = ds.ReferencedImageSequence[0]
+    assert str(item.PatientName) == "ANONYMOUS"
+    assert item.ReferencedSOPInstanceUID != "1.2.3.4.5"
+
+
+def test_profile_covers_procedure_and_comment_attributes():
+    ds = make_instance(generate_uid(), generate_uid())
+    removed = {
+        "ProtocolName": "CHEST ROUTINE (Dr. Smith)",
+        "PerformedProcedureStepDescription": "CT chest for Jane Doe",
+        "PerformedProcedureStepStartDate": "20240102",
+        "RequestedProcedureDescription": "CT chest",
+        "ImageComments": "patient moved",
+        "IssuerOfPatientID": "General Hospital",
+        "PatientBirthName": "Roe^Jane",
+        "ReferringPhysicianAddress": "1 Main St",
+        "StudyComments": "follow-up of 2023 finding",
+    }
+    for keyword, value in removed.items():
+        setattr(ds, keyword, value)
+    ds.PlacerOrderNumberImagingServiceRequest = "ORD-7"
+    ds.InstanceCreatorUID = "1.2.3.4.6"
+
+    ds = deidentify(ds, RULES, SALT)
+    assert not [keyword for keyword in removed if keyword in ds]
+    assert ds.PlacerOrderNumberImagingServiceRequest == ""
+    assert ds.InstanceCreatorUID != "1.2.3.4.6"
+
+
+def test_uid_remapping_is_consistent_across_instances():
+    study_uid, series_uid = generate_uid(), generate_uid()
+    first = deidentify(make_instance(study_uid, series_uid), RULES, SALT)
+    second = deidentify(make_instance(study_uid, series_uid), RULES, SALT)
+
+    assert first.StudyInstanceUID == second.StudyInstanceUID != study_uid
+    assert first.SeriesInstanceUID == second.SeriesInstanceUID != series_uid
+    assert first.SOPInstanceUID != second.SOPInstanceUID
+    # References to the same original UID land on the same replacement
+    assert first.ReferencedImageSequence[0].ReferencedSOPInstanceUID == \
+        second.ReferencedImageSequence[0].ReferencedSOPInstanceUID
+
+    other_salt = deidentify(make_instance(study_uid, series_uid), RULES, "other")
+    assert other_salt.StudyInstanceUID != first.StudyInstanceUID
+
+
+def test_unknown_keyword_is_rejected():
+    with pytest.raises(ValueError):
+        compile_profile({"NotARealKeyword": "X"})
+
+
+def test_stage_writes_deidentified_copies(tmp_path):
+    study_uid, series_uid = generate_uid(), generate_uid()
+    originals = []
+    for _ in range(10):
+        ds = make_instance(study_uid, series_uid)
+        path = tmp_path / f"{ds.SOPInstanceUID}.dcm"
+        ds.save_as(path, write_like_original=False)
+        originals.append(path)
+
+    stage = DeidStage()
+    stage.start("write", tmp_path / "deid", workers=2, batch_size=4, batch_wait=0.05, salt=SALT)
+    for path in originals:
+        stage.submit(path)
+    stage.close()
+
+    assert stage.stats()["succeeded"] == len(originals)
+    copies = list((tmp_path / "deid").glob("**/*.dcm"))
+    assert len(copies) == len(originals)
+    copy = dcmread(copies[0])
+    assert copy.PatientIdentityRemoved == "YES"
+    assert copy.file_meta.MediaStorageSOPInstanceUID == copy.SOPInstanceUID
+    assert copy.StudyInstanceUID != study_uid
+
+
+def test_full_queue_blocks_instead_of_dropping(tmp_path):
+    stage = DeidStage(queue_size=1)
+    # Enabled, but with no batcher draining the queue
+    stage.executor = object()
+    assert stage.submit(tmp_path / "a.dcm")
+    blocked = threading.Thread(target=stage.submit, args=(tmp_path / "b.dcm",))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+
+    assert stage.queue.get() == str(tmp_path / "a.dcm")
+    blocked.join(5)
+    assert not blocked.is_alive()
+    assert stage.queue.get_nowait() == str(tmp_path / "b.dcm")
+    assert stage.stats()["stalled"] == 1
+
+
+def test_failed_batch_counts_every_instance():
+    stage = DeidStage()
+    stage.in_flight = threading.BoundedSemaphore(1)
+    stage.in_flight.acquire()
+    future = Future()
+    future.set_exception(BrokenProcessPool("worker died"))
+    stage._done(5, future)
+    assert stage.stats()["failed"] == 5
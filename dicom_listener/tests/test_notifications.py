@@ -0,0 +1,248 @@
+import sys
+import time
+import zlib
+import threading
+import pytest
+from pathlib import Path
+from pydicom.uid import generate_uid
+
+import listener
+from registry import StudyRegistry
+from notifications import (
+    SCHEMA_VERSION, JSON, MSGPACK, study_notification, encode_messages, decode, resolve_encoding,
+    resolve_manifest_mode,
+)
+from tests.helpers import make_instance, store_event
+
+
+def completed_study(slices=5):
+    """StudyRecord of one series that arrived in reverse order"""
+    registry = StudyRegistry()
+    study_uid, series_uid = generate_uid(), generate_uid()
+    # Arrive out of order; manifests are sorted by slice position
+    for number in reversed(range(1, slices + 1)):
+        study = registry.add_instance(make_instance(study_uid, series_uid, number), 1000 + number, number)
+    return study
+
+
+def test_manifest_is_sorted_and_complete(tmp_path):
+    study = completed_study()
+    message = study_notification(study, tmp_path, {})
+    assert message["schema_version"] == SCHEMA_VERSION
+    assert message["slice_count"] == 5
+
+    series, = message["series"]
+    manifest = series["manifest"]
+    assert series["directory"] == str(tmp_path / series["series_uid"])
+    # z decreases with InstanceNumber, so ascending position is descending InstanceNumber
+    assert manifest["instance_numbers"] == [5, 4, 3, 2, 1]
+    assert manifest["positions"] == sorted(manifest["positions"])
+    assert manifest["sizes"] == [1005, 1004, 1003, 1002, 1001]
+    assert manifest["crc32"] == [5, 4, 3, 2, 1]
+    assert manifest["files"] == [f"{uid}.dcm" for uid in manifest["sop_instance_uids"]]
+
+
+def test_notification_of_a_study_still_receiving_instances(tmp_path):
+    registry = StudyRegistry()
+    study_uid, series_uid = generate_uid(), generate_uid()
+    study = registry.add_instance(make_instance(study_uid, series_uid, 1))
+    instances = [make_instance(study_uid, series_uid, n) for n in range(2, 2001)]
+    done = threading.Event()
+
+    def receive():
+        for ds in instances:
+            registry.add_instance(ds, 1000)
+        done.set()
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    thread = threading.Thread(target=receive)
+    thread.start()
+    try:
+        while not done.is_set():
+            study_notification(registry.copy_study(study), tmp_path, {})
+    finally:
+        thread.join()
+        sys.setswitchinterval(interval)
+    assert study_notification(registry.copy_study(study), tmp_path, {})["slice_count"] == 2000
+
+
+def test_small_study_is_one_message(tmp_path):
+    messages = encode_messages(study_notification(completed_study(), tmp_path, {}))
+    (body, content_type, headers), = messages
+    assert content_type == JSON
+    assert headers["type"] == "study"
+    assert decode(body, content_type)["series"][0]["manifest"]["sizes"]
+
+
+def test_large_manifest_is_chunked(tmp_path):
+    study = completed_study(slices=25)
+    messages = encode_messages(study_notification(study, tmp_path, {}), inline_limit=1024, mode="chunked", chunk_size=10)
+    decoded = [decode(body, content_type) for body, content_type, _ in messages]
+
+    *chunks, summary = decoded
+    assert [c["type"] for c in chunks] == ["series_manifest"] * 3
+    assert summary["series"][0]["manifest_chunks"] == 3
+    assert "manifest" not in summary["series"][0]
+
+    expected = study_notification(study, tmp_path, {})["series"][0]["manifest"]
+    rebuilt = sum((c["manifest"]["sop_instance_uids"] for c in chunks), [])
+    assert rebuilt == expected["sop_instance_uids"]
+
+
+def test_large_manifest_is_referenced(tmp_path):
+    study = completed_study(slices=25)
+    messages = encode_messages(study_notification(study, tmp_path, {}), inline_limit=1024)
+    (body, content_type, _), = messages
+
+    ref = decode(body, content_type)["series"][0]["manifest_ref"]
+    data = Path(ref["path"]).read_bytes()
+    assert len(data) == ref["size"] and zlib.crc32(data) == ref["crc32"]
+    assert len(decode(data, ref["content_type"])["sop_instance_uids"]) == 25
+
+
+def test_concurrent_announcements_write_the_same_manifest(tmp_path):
+    study = completed_study(slices=25)
+    errors = []
+
+    def announce():
+        try:
+            for _ in range(20):
+                encode_messages(study_notification(study, tmp_path, {}), inline_limit=1024)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=announce) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert [p.suffix for p in tmp_path.iterdir()] == [".json"]
+
+def test_unknown_manifest_mode_is_rejected():
+    with pytest.raises(ValueError):
+        resolve_manifest_mode("inline")
+
+
+def test_msgpack_encoding(tmp_path):
+    pytest.importorskip("msgpack")
+    message = study_notification(completed_study(), tmp_path, {})
+    (body, content_type, _), = encode_messages(message, encoding=resolve_encoding("msgpack"))
+    assert content_type == MSGPACK
+    assert decode(body, content_type) == message
+    assert len(body) < len(encode_messages(message)[0][0])
+
+
+def test_study_is_announced_once_then_updated(tmp_path, monkeypatch):
+    monkeypatch.setattr(listener.Config, "STORAGE_PATH", tmp_path)
+    monkeypatch.setattr(listener.Config, "NOTIFICATION_REPUBLISH_DELAY", 0)
+    monkeypatch.setattr(listener, "registry", StudyRegistry())
+    monkeypatch.setattr(listener, "late_studies", {})
+    monkeypatch.setattr(listener, "announce_retries", {})
+    published = []
+    monkeypatch.setattr(listener.publisher, "publish_study", lambda uid, messages: published.append(messages) or True)
+
+    study_uid, series_uid = generate_uid(), generate_uid()
+    for number in range(1, 21):
+        # No NumberOfSeriesRelatedInstances, so the study is complete from its first instance
+        assert listener.handle_store(store_event(make_instance(study_uid, series_uid, number))) == 0x0000
+    assert len(published) == 1
+
+    # Late instances are folded into a single re-announcement
+    assert listener.republish_late_studies() == 1
+    assert listener.republish_late_studies() == 0
+    body, content_type, _ = published[-1][-1]
+    manifest = decode(body, content_type)["series"][0]["manifest"]
+    assert len(manifest["sop_instance_uids"]) == 20
+    stored = tmp_path / study_uid / series_uid / manifest["files"][0]
+    assert zlib.crc32(stored.read_bytes()) == manifest["crc32"][0]
+
+
+def test_failed_announcement_is_retried_with_backoff(tmp_path, monkeypatch):
+    monkeypatch.setattr(listener.Config, "STORAGE_PATH", tmp_path)
+    monkeypatch.setattr(listener.Config, "NOTIFICATION_REPUBLISH_DELAY", 0)
+    monkeypatch.setattr(listener.Config, "NOTIFICATION_RETRY_DELAY", 10)
+    monkeypatch.setattr(listener, "registry", StudyRegistry())
+    monkeypatch.setattr(listener, "late_studies", {})
+    monkeypatch.setattr(listener, "announce_retries", {})
+    published = []
+    broker_up = False
+    monkeypatch.setattr(listener.publisher, "publish_study", lambda uid, messages: broker_up and not published.append(uid))
+
+    study_uid, series_uid = generate_uid(), generate_uid()
+    assert listener.handle_store(store_event(make_instance(study_uid, series_uid, 1))) == 0x0000
+    study = listener.registry.get(study_uid)
+    # Snapshots keep the study pending, so a restart announces it too
+    assert not study.completed
+    assert listener.republish_late_studies() == 0
+
+    # Each failure doubles the delay
+    listener.announce_retries[study_uid] = (1, 0.0)
+    assert listener.republish_late_studies() == 1
+    failures, retry_at = listener.announce_retries[study_uid]
+    assert failures == 2 and retry_at > time.time() + 15
+    assert published == []
+
+    broker_up = True
+    listener.announce_retries[study_uid] = (2, 0.0)
+    assert listener.republish_late_studies() == 1
+    assert published == [study_uid]
+    assert study.completed
+    assert study_uid not in listener.announce_retries
+    assert listener.republish_late_studies() == 0
+
+
+def test_retry_pass_stops_while_the_broker_is_down(tmp_path, monkeypatch):
+    monkeypatch.setattr(listener.Config, "STORAGE_PATH", tmp_path)
+    monkeypatch.setattr(listener, "registry", StudyRegistry())
+    monkeypatch.setattr(listener, "late_studies", {})
+    monkeypatch.setattr(listener, "announce_retries", {})
+    attempts = []
+    monkeypatch.setattr(listener.publisher, "publish_study", lambda uid, messages: attempts.append(uid) and False)
+
+    studies = [generate_uid() for _ in range(3)]
+    for study_uid in studies:
+        listener.handle_store(store_event(make_instance(study_uid, generate_uid(), 1)))
+    attempts.clear()
+
+    assert listener.republish_late_studies(force=True) == 3
+    assert len(attempts) == 1
+    assert sorted(listener.late_studies) == sorted(studies)
+    assert all(failures == 2 for failures, _ in listener.announce_retries.values())
+
+
+def test_pending_complete_study_is_announced_after_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(listener.Config, "STORAGE_PATH", tmp_path)
+    monkeypatch.setattr(listener, "registry", StudyRegistry())
+    monkeypatch.setattr(listener, "late_studies", {})
+    monkeypatch.setattr(listener, "announce_retries", {})
+    monkeypatch.setattr(listener.publisher, "publish_study", lambda uid, messages: False)
+    study_uid, series_uid = generate_uid(), generate_uid()
+    listener.handle_store(store_event(make_instance(study_uid, series_uid, 1)))
+    listener.registry.snapshot(tmp_path / "registry.json")
+
+    published = []
+    monkeypatch.setattr(listener.publisher, "publish_study", lambda uid, messages: not published.append(uid))
+    monkeypatch.setattr(listener, "registry", StudyRegistry())
+    listener.registry.restore(tmp_path / "registry.json")
+    listener.reconcile_registry()
+    assert published == [study_uid]
+
+
+def test_retry_skips_a_study_completed_meanwhile(tmp_path, monkeypatch):
+    monkeypatch.setattr(listener.Config, "STORAGE_PATH", tmp_path)
+    monkeypatch.setattr(listener, "registry", StudyRegistry())
+    monkeypatch.setattr(listener, "late_studies", {})
+    monkeypatch.setattr(listener, "announce_retries", {})
+    monkeypatch.setattr(listener.publisher, "publish_study", lambda uid, messages: False)
+    study_uid = generate_uid()
+    listener.handle_store(store_event(make_instance(study_uid, generate_uid(), 1)))
+
+    published = []
+    monkeypatch.setattr(listener.publisher, "publish_study", lambda uid, messages: not published.append(uid))
+    # handle_store re-completed and announced the pending study first
+    study = listener.registry.get(study_uid)
+    assert listener.registry.mark_completed(study)
+    assert listener.republish_late_studies(force=True) == 1
+    assert published == []
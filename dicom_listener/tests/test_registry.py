@@ -0,0 +1,169 @@
+import sys
+import zlib
+import math
+import threading
+import pytest
+from pydicom.uid import generate_uid
+
+import listener
+from registry import StudyRegistry
+from bench_registry import measure, make_instances, build_registry
+from tests.helpers import make_instance, store_event
+
+
+def test_completion_counts_unique_instances():
+    registry = StudyRegistry()
+    study_uid, series_uid = generate_uid(), generate_uid()
+
+    first = make_instance(study_uid, series_uid, 1, expected=3)
+    study = registry.add_instance(first, 100)
+    assert not study.is_complete()
+
+    # A re-sent instance must not count twice
+    registry.add_instance(make_instance(study_uid, series_uid, 1, sop_uid=first.SOPInstanceUID), 120)
+    registry.add_instance(make_instance(study_uid, series_uid, 2), 100)
+    assert study.instance_count == 2
+    assert not study.is_complete()
+
+    registry.add_instance(make_instance(study_uid, series_uid, 3), 100)
+    assert study.is_complete()
+
+    series = study.series[series_uid]
+    assert series.instance_uids()[0] == first.SOPInstanceUID
+    assert list(series.sizes) == [120, 100, 100]
+    assert list(series.positions) == [-2.5, -5.0, -7.5]
+
+
+def test_uids_are_interned():
+    registry = StudyRegistry()
+    study_uid, series_uid = generate_uid(), generate_uid()
+    # Equal but distinct string objects, as decoded from separate associations
+    study = registry.add_instance(make_instance("".join(list(study_uid)), "".join(list(series_uid)), 1))
+    assert study.study_uid is sys.intern(str(study_uid))
+    assert next(iter(study.series)) is sys.intern(str(series_uid))
+
+
+def test_snapshot_roundtrip(tmp_path):
+    registry = StudyRegistry()
+    study_uid, series_uid = generate_uid(), generate_uid()
+    for i in range(5):
+        registry.add_instance(make_instance(study_uid, series_uid, i + 1, expected=5), 1000 + i)
+    no_position = make_instance(study_uid, series_uid, 6)
+    del no_position.ImagePositionPatient
+    registry.add_instance(no_position)
+
+    registry.snapshot(tmp_path / "registry.json")
+    restored = StudyRegistry()
+    assert restored.restore(tmp_path / "registry.json") == 1
+
+    original = registry.get(study_uid).series[series_uid]
+    copy = restored.get(study_uid).series[series_uid]
+    assert copy.instance_uids() == original.instance_uids()
+    assert list(copy.sizes) == list(original.sizes)
+    assert list(copy.instance_numbers) == list(original.instance_numbers)
+    assert list(copy.positions)[:5] == list(original.positions)[:5]
+    assert math.isnan(copy.positions[5])
+    assert restored.get(study_uid).is_complete()
+    # Restored records keep deduplicating
+    restored.add_instance(make_instance(study_uid, series_uid, 1, sop_uid=original.instance_uids()[0]))
+    assert restored.get(study_uid).instance_count == 6
+
+
+def test_concurrent_snapshots_leave_a_valid_file(tmp_path):
+    registry = StudyRegistry()
+    study_uid, series_uid = generate_uid(), generate_uid()
+    for i in range(50):
+        registry.add_instance(make_instance(study_uid, series_uid, i + 1), 1000)
+
+    threads = [threading.Thread(target=registry.snapshot, args=(tmp_path / "registry.json",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert StudyRegistry().restore(tmp_path / "registry.json") == 1
+    assert [p.name for p in tmp_path.iterdir()] == ["registry.json"]
+
+
+def test_prune_drops_idle_studies():
+    registry = StudyRegistry(retention_seconds=60)
+    study = registry.add_instance(make_instance(generate_uid(), generate_uid(), 1))
+    assert registry.prune(now=study.last_seen + 30) == 0
+    assert registry.prune(now=study.last_seen + 120) == 1
+    assert len(registry) == 0
+
+
+def test_bytes_per_instance_stays_compact():
+    assert measure(build_registry, make_instances(200, 2, 50)) < 200
+
+
+@pytest.fixture
+def gateway(tmp_path, monkeypatch):
+    """listener with a fresh registry and a recording publisher"""
+    monkeypatch.setattr(listener.Config, "STORAGE_PATH", tmp_path)
+    monkeypatch.setattr(listener, "registry", StudyRegistry())
+    monkeypatch.setattr(listener, "late_studies", {})
+    monkeypatch.setattr(listener, "announce_retries", {})
+    published = []
+    monkeypatch.setattr(listener.publisher, "publish_study", lambda uid, messages: published.append(uid) or True)
+    return published
+
+
+def store_files(instances):
+    for ds in instances:
+        path = listener.Config.STORAGE_PATH / ds.StudyInstanceUID / ds.SeriesInstanceUID
+        path.mkdir(parents=True, exist_ok=True)
+        ds.save_as(path / f"{ds.SOPInstanceUID}.dcm", enforce_file_format=True)
+
+
+def test_unknown_study_is_recovered_from_disk(gateway):
+    study_uid, series_uid = generate_uid(), generate_uid()
+    # Stored before a crash that lost the registry
+    store_files(make_instance(study_uid, series_uid, n, expected=5) for n in range(1, 5))
+
+    assert listener.handle_store(store_event(make_instance(study_uid, series_uid, 5, expected=5))) == 0x0000
+    study = listener.registry.get(study_uid)
+    assert study.instance_count == 5
+    assert all(study.series[series_uid].checksums)
+    assert gateway == [study_uid]
+
+
+def test_restored_snapshot_is_reconciled_with_disk(gateway, tmp_path):
+    study_uid, series_uid = generate_uid(), generate_uid()
+    instances = [make_instance(study_uid, series_uid, n, expected=3) for n in range(1, 4)]
+    store_files(instances[:1])
+    listener.recover_study(study_uid)
+    listener.registry.snapshot(tmp_path / "registry.json")
+
+    # Stored after the last snapshot
+    store_files(instances[1:])
+    listener.registry = StudyRegistry()
+    listener.registry.restore(tmp_path / "registry.json")
+    listener.reconcile_registry()
+    assert listener.registry.get(study_uid).instance_count == 3
+    assert gateway == [study_uid]
+
+
+def test_recovery_never_reads_or_overwrites_a_concurrent_store(gateway, monkeypatch):
+    study_uid, series_uid = generate_uid(), generate_uid()
+    first = make_instance(study_uid, series_uid, 1, expected=2)
+    path = listener.Config.STORAGE_PATH / study_uid / series_uid / f"{first.SOPInstanceUID}.dcm"
+
+    # Another association recovers the study while this store is still writing
+    recovered = []
+    replace = listener.os.replace
+    def replace_after_recovery(src, dst):
+        recovered.append(listener.recover_study(study_uid))
+        replace(src, dst)
+    monkeypatch.setattr(listener.os, "replace", replace_after_recovery)
+    assert listener.handle_store(store_event(first)) == 0x0000
+    assert recovered == [0]
+    monkeypatch.setattr(listener.os, "replace", replace)
+
+    data = path.read_bytes()
+    # A partial file, as left by a writer still in progress, must not replace the stored values
+    path.write_bytes(data[:len(data) - 40])
+    listener.recover_study(study_uid)
+    series = listener.registry.get(study_uid).series[series_uid]
+    assert list(series.sizes) == [len(data)]
+    assert list(series.checksums) == [zlib.crc32(data)]
+    assert [p.name for p in path.parent.iterdir()] == [path.name]
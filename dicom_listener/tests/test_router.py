@@ -0,0 +1,175 @@
+import os
+import sys
+import subprocess
+import time
+import threading
+from types import SimpleNamespace
+import pytest
+from pathlib import Path
+from pynetdicom import AE, evt
+from pynetdicom.dsutils import encode
+from pynetdicom.sop_class import CTImageStorage
+from pydicom.uid import generate_uid, ExplicitVRLittleEndian, ImplicitVRLittleEndian, DeflatedExplicitVRLittleEndian
+
+import router
+from router import HashRing, BackendPool, check_backend, start_router, peek_study_uid
+from tests.helpers import free_port, make_instance
+
+LISTENER = Path(__file__).resolve().parent.parent / "listener.py"
+NODE_COUNT = 3
+
+
+@pytest.fixture(scope="module")
+def gateways(tmp_path_factory):
+    """Run several local gateway listener processes"""
+    root = tmp_path_factory.mktemp("gateways")
+    nodes, processes = [], []
+    for i in range(NODE_COUNT):
+        port = free_port()
+        storage = root / f"node{i}"
+        env = dict(
+            os.environ,
+            LISTEN_PORT=str(port),
+            STORAGE_PATH=str(storage),
+            RABBITMQ_HOST="127.0.0.1",
+        )
+        processes.append(subprocess.Popen(
+            [sys.executable, str(LISTENER)], cwd=root, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+        nodes.append((("localhost", port, "DICOM_GATEWAY"), storage))
+
+    deadline = time.time() + 30
+    for backend, _ in nodes:
+        while not check_backend(backend):
+            assert time.time() < deadline, f"Gateway on port {backend[1]} did not start"
+            time.sleep(0.2)
+
+    yield nodes
+
+    for process in processes:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def test_ring_rebalance_moves_only_removed_backend_keys():
+    backends = [("gw", 11113 + i, "DICOM_GATEWAY") for i in range(4)]
+    ring = HashRing(backends)
+    keys = [generate_uid() for _ in range(2000)]
+    before = {key: ring.get(key) for key in keys}
+
+    ring.remove(backends[0])
+    for key in keys:
+        if before[key] != backends[0]:
+            assert ring.get(key) == before[key]
+    assert {ring.get(key) for key in keys} == set(backends[1:])
+
+
+def test_ring_tracks_members():
+    backends = [("gw", 11113 + i, "DICOM_GATEWAY") for i in range(3)]
+    ring = HashRing(backends)
+    ring.remove(backends[1])
+    assert backends[1] not in ring
+    assert ring.backends == {backends[0], backends[2]}
+
+
+class SlowAssociation:
+    is_established = True
+
+    def send_c_store(self, ds):
+        time.sleep(0.2)
+        return SimpleNamespace(Status=0x0000)
+
+    def release(self):
+        self.is_established = False
+
+
+def test_pool_sends_concurrently_and_reuses_associations(monkeypatch):
+    pool = BackendPool(("gw", 11113, "DICOM_GATEWAY"), size=2)
+    monkeypatch.setattr(router, "forward", lambda assoc, event: assoc.send_c_store(event.dataset))
+    created = []
+    monkeypatch.setattr(pool, "_associate", lambda: created.append(SlowAssociation()) or created[-1])
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=pool.send, args=(SimpleNamespace(dataset=None),)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Two at a time rather than one after another
+    assert time.monotonic() - started < 0.7
+    assert len(created) == 2
+
+    pool.close()
+    assert not any(assoc.is_established for assoc in created)
+
+
+def test_studies_stick_to_one_gateway(gateways):
+    port = free_port()
+    server, router, stop = start_router([backend for backend, _ in gateways], port=port, block=False)
+    try:
+        ae = AE()
+        ae.add_requested_context(CTImageStorage)
+        studies = [generate_uid() for _ in range(6)]
+        for study_uid in studies:
+            series = [generate_uid(), generate_uid()]
+            # One association per instance, as modalities like ct-sim do
+            for i in range(4):
+                assoc = ae.associate("localhost", port)
+                assert assoc.is_established
+                status = assoc.send_c_store(make_instance(study_uid, series[i % 2]))
+                assert status.Status == 0x0000
+                assoc.release()
+
+        for study_uid in studies:
+            holders = [storage for _, storage in gateways if (storage / study_uid).exists()]
+            assert len(holders) == 1
+            assert len(list(holders[0].joinpath(study_uid).glob("**/*.dcm"))) == 4
+    finally:
+        stop.set()
+        router.close()
+        server.shutdown()
+
+
+@pytest.mark.parametrize(
+    "transfer_syntax", [ExplicitVRLittleEndian, ImplicitVRLittleEndian, DeflatedExplicitVRLittleEndian],
+)
+def test_study_uid_is_peeked_from_encoded_bytes(transfer_syntax):
+    ds = make_instance(generate_uid(), generate_uid())
+    data = encode(ds, transfer_syntax.is_implicit_VR, transfer_syntax.is_little_endian, transfer_syntax.is_deflated)
+    assert peek_study_uid(data, transfer_syntax) == ds.StudyInstanceUID
+
+
+def test_router_forwards_the_received_encoding(monkeypatch):
+    forwarded = []
+    send_encoded = router.send_encoded
+    monkeypatch.setattr(router, "send_encoded", lambda *args: forwarded.append(args[2]) or send_encoded(*args))
+    received = []
+    def handle_store(event):
+        received.append(event.request.DataSet.getvalue())
+        return 0x0000
+
+    backend_port, router_port = free_port(), free_port()
+    backend_ae = AE(ae_title="DICOM_GATEWAY")
+    backend_ae.add_supported_context(CTImageStorage)
+    backend = backend_ae.start_server(
+        ("localhost", backend_port), evt_handlers=[(evt.EVT_C_STORE, handle_store)], block=False,
+    )
+    server, study_router, stop = start_router(
+        [("localhost", backend_port, "DICOM_GATEWAY")], port=router_port, block=False,
+    )
+    try:
+        ae = AE()
+        ae.add_requested_context(CTImageStorage, ExplicitVRLittleEndian)
+        ds = make_instance(generate_uid(), generate_uid())
+        assoc = ae.associate("localhost", router_port)
+        assert assoc.send_c_store(ds).Status == 0x0000
+        assoc.release()
+        assert received == [encode(ds, False, True)]
+        # Sent as received, not re-encoded from a decoded dataset
+        assert forwarded == [CTImageStorage]
+    finally:
+        stop.set()
+        study_router.close()
+        server.shutdown()
+        backend.shutdown()
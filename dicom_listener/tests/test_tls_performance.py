@@ -0,0 +1,102 @@
+import shutil
+import socket
+import ssl
+import subprocess
+import pytest
+from pynetdicom import AE
+from pynetdicom.sop_class import Verification
+
+from listener import Config, configure_tls
+from tls import AES128_GCM, CHACHA20
+from tests.helpers import free_port
+
+pytestmark = pytest.mark.skipif(shutil.which("openssl") is None, reason="openssl CLI required")
+
+
+@pytest.fixture
+def certs(tmp_path, monkeypatch):
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost",
+         "-keyout", str(tmp_path / "server.key"), "-out", str(tmp_path / "server.crt")],
+        check=True, capture_output=True,
+    )
+    monkeypatch.setattr(Config, "TLS_ENABLED", True)
+    monkeypatch.setattr(Config, "SERVER_CRT", tmp_path / "server.crt")
+    monkeypatch.setattr(Config, "SERVER_KEY", tmp_path / "server.key")
+
+
+def start_scp(ssl_context):
+    """Verification SCP on a free port; returns (server, port)"""
+    port = free_port()
+    ae = AE()
+    ae.add_supported_context(Verification)
+    return ae.start_server(("localhost", port), ssl_context=ssl_context, block=False), port
+
+
+def tls12_client(ciphers):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.maximum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(ciphers)
+    return context
+
+
+def handshake(context, port, session=None):
+    with socket.create_connection(("localhost", port)) as raw:
+        with context.wrap_socket(raw, server_hostname="localhost", session=session) as tls:
+            return tls.session, tls.session_reused, tls.cipher()[0]
+
+
+@pytest.mark.parametrize("client_ciphers", [AES128_GCM, CHACHA20])
+def test_performance_policy_accepts_fast_ciphers(certs, monkeypatch, client_ciphers):
+    monkeypatch.setattr(Config, "TLS_CIPHER_POLICY", "performance")
+    server, port = start_scp(configure_tls())
+    try:
+        _, _, cipher = handshake(tls12_client(client_ciphers), port)
+        assert cipher in client_ciphers.split(":")
+    finally:
+        server.shutdown()
+
+
+def test_strict_policy_keeps_aes256_only(certs, monkeypatch):
+    monkeypatch.setattr(Config, "TLS_CIPHER_POLICY", "strict")
+    server, port = start_scp(configure_tls())
+    try:
+        with pytest.raises(ssl.SSLError):
+            handshake(tls12_client(AES128_GCM), port)
+    finally:
+        server.shutdown()
+
+
+def test_sessions_resume_and_handshakes_are_counted(certs, monkeypatch):
+    monkeypatch.setattr(Config, "TLS_CIPHER_POLICY", "performance")
+    ssl_context = configure_tls()
+    stats = ssl_context.handshake_stats
+    before = stats.snapshot()
+    server, port = start_scp(ssl_context)
+    try:
+        client = tls12_client(AES128_GCM)
+        session, reused, _ = handshake(client, port)
+        assert not reused
+        for _ in range(3):
+            _, reused, _ = handshake(client, port, session=session)
+            assert reused
+    finally:
+        server.shutdown()
+
+    after = stats.snapshot()
+    assert after["handshakes"] - before["handshakes"] == 4
+    assert after["resumed"] - before["resumed"] == 3
+    assert after["mean_ms"] > 0
+
+
+def test_unknown_cipher_policy_refuses_to_start(certs, monkeypatch):
+    monkeypatch.setattr(Config, "TLS_CIPHER_POLICY", "performence")
+    with pytest.raises(ValueError, match="performence"):
+        configure_tls()
+
+    # Raw OpenSSL cipher strings are still accepted
+    monkeypatch.setattr(Config, "TLS_CIPHER_POLICY", AES128_GCM)
+    assert configure_tls() is not None
@@ -0,0 +1,59 @@
+import json
+import pytest
+
+import tracing
+from tracing import Tracer, SpanExporter, STATUS_ERROR
+
+
+class CollectingExporter:
+    def __init__(self):
+        self.spans = []
+
+    def submit(self, span):
+        self.spans.append(span)
+
+
+def test_store_stages_nest_under_one_trace():
+    exporter = CollectingExporter()
+    tracer = Tracer(exporter)
+
+    with tracer.span("c_store", **{"dicom.sop_instance_uid": "1.2.3"}):
+        with tracer.span("decode"):
+            pass
+        with pytest.raises(OSError):
+            with tracer.span("filesystem.write"):
+                raise OSError("disk full")
+
+    decode, write, root = exporter.spans
+    assert root.parent_id is None
+    assert decode.parent_id == write.parent_id == root.span_id
+    assert len({span.trace_id for span in exporter.spans}) == 1
+    assert write.status == STATUS_ERROR
+    assert root.end_ns >= decode.end_ns >= decode.start_ns >= root.start_ns
+
+
+def test_unsampled_trace_exports_nothing():
+    exporter = CollectingExporter()
+    tracer = Tracer(exporter, sample_ratio=0.0)
+
+    with tracer.span("c_store"):
+        with tracer.span("decode") as span:
+            span.set_attribute("ignored", True)
+    assert exporter.spans == []
+
+
+def test_file_export_is_otlp_json(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing.Config, "TRACE_FILE", tmp_path / "traces.jsonl")
+    exporter = CollectingExporter()
+    tracer = Tracer(exporter)
+    with tracer.span("c_store", **{"study.complete": True, "retries": 2}):
+        pass
+
+    SpanExporter("file").export(exporter.spans)
+    payload = json.loads((tmp_path / "traces.jsonl").read_text())
+    span = payload["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert span["name"] == "c_store"
+    assert len(span["traceId"]) == 32 and len(span["spanId"]) == 16
+    assert {"key": "retries", "value": {"intValue": "2"}} in span["attributes"]
+    assert {"key": "study.complete", "value": {"boolValue": True}} in span["attributes"]
+
@@ -0,0 +1,104 @@
+import ssl
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# OpenSSL cipher strings for TLS 1.2. TLS 1.3 suites (AES-128-GCM, AES-256-GCM,
+# ChaCha20-Poly1305) are always offered; the ssl module cannot restrict them.
+AES256_GCM = 'ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-GCM-SHA384'
+AES128_GCM = 'ECDHE-ECDSA-AES128-GCM-SHA256:ECDHE-RSA-AES128-GCM-SHA256'
+CHACHA20 = 'ECDHE-ECDSA-CHACHA20-POLY1305:ECDHE-RSA-CHACHA20-POLY1305'
+
+CIPHER_POLICIES = {
+    # Previous fixed behaviour
+    'strict': AES256_GCM,
+    # AES-128 first (AES-NI), ChaCha20 for peers without AES hardware
+    'performance': ':'.join([AES128_GCM, CHACHA20, AES256_GCM]),
+    'chacha20': ':'.join([CHACHA20, AES128_GCM]),
+}
+
+LOG_EVERY = 100
+
+
+def resolve_ciphers(policy: str) -> str:
+    """Map a policy name to a cipher string; anything else must be a valid OpenSSL cipher string"""
+    ciphers = CIPHER_POLICIES.get(policy.lower())
+    if ciphers:
+        return ciphers
+    try:
+        ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER).set_ciphers(policy)
+    except ssl.SSLError:
+        raise ValueError(f"Unknown TLS cipher policy: {policy}") from None
+    return policy
+
+
+class HandshakeStats:
+    """Thread-safe TLS handshake counters"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handshakes = 0
+        self.resumed = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float, resumed: bool):
+        with self.lock:
+            self.handshakes += 1
+            self.resumed += resumed
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            count = self.handshakes
+        if count % LOG_EVERY == 0:
+            logger.info(f"TLS handshakes: {self.snapshot()}")
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "handshakes": self.handshakes,
+                "resumed": self.resumed,
+                "failures": self.failures,
+                "mean_ms": round(1000 * self.total_seconds / self.handshakes, 3) if self.handshakes else 0.0,
+                "max_ms": round(1000 * self.max_seconds, 3),
+            }
+
+
+handshake_stats = HandshakeStats()
+
+
+class InstrumentedSSLSocket(ssl.SSLSocket):
+    """SSLSocket that records handshake duration and resumption"""
+
+    def do_handshake(self, block=False):
+        start = time.perf_counter()
+        try:
+            super().do_handshake(block)
+        except (ssl.SSLError, OSError):
+            self.context.handshake_stats.record_failure()
+            raise
+        self.context.handshake_stats.record(time.perf_counter() - start, self.session_reused)
+
+
+def instrument_context(context: ssl.SSLContext, stats: HandshakeStats = handshake_stats) -> ssl.SSLContext:
+    """Route the context's sockets through InstrumentedSSLSocket"""
+    context.sslsocket_class = InstrumentedSSLSocket
+    context.handshake_stats = stats
+    return context
+
+
+def enable_session_resumption(context: ssl.SSLContext, tickets: int) -> ssl.SSLContext:
+    """Enable stateless tickets (TLS 1.2/1.3) alongside OpenSSL's server session cache"""
+    if tickets > 0:
+        context.options &= ~ssl.OP_NO_TICKET
+        context.num_tickets = tickets
+    else:
+        context.options |= ssl.OP_NO_TICKET
+        context.num_tickets = 0
+    return context
@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class Config:
+    # none | file | otlp
+    TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'none').lower()
+    TRACE_FILE = Path(os.getenv('TRACE_FILE', './traces.jsonl'))
+    # OTLP/HTTP JSON endpoint of an OpenTelemetry collector
+    OTLP_ENDPOINT = os.getenv('OTLP_ENDPOINT', 'http://otel-collector:4318/v1/traces')
+    TRACE_SAMPLE_RATIO = float(os.getenv('TRACE_SAMPLE_RATIO', 1.0))
+    SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'dicom-gateway')
+    BATCH_SIZE = 256
+    FLUSH_INTERVAL = 2.0
+
+logger = logging.getLogger(__name__)
+
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def _attribute(key, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Span:
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'status')
+
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = STATUS_OK
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.attributes["exception.type"] = type(error).__name__
+        self.attributes["exception.message"] = str(error)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+    def record_error(self, error: BaseException):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class SpanExporter:
+    """Batches finished spans on a background thread and writes OTLP/JSON"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.queue = queue.Queue(maxsize=10000)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, daemon=True, name='trace-exporter')
+        self.thread.start()
+
+    def submit(self, span: Span):
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            # Never block the store path on tracing
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + Config.FLUSH_INTERVAL
+            while len(batch) < Config.BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self.export(batch)
+            except Exception as e:
+                logger.warning(f"Trace export failed ({len(batch)} spans): {e}")
+
+    def export(self, spans):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_attribute("service.name", Config.SERVICE_NAME)]},
+                "scopeSpans": [{
+                    "scope": {"name": "dicom_listener"},
+                    "spans": [span.to_otlp() for span in spans],
+                }],
+            }]
+        }
+        body = json.dumps(payload)
+        if self.kind == 'file':
+            with open(Config.TRACE_FILE, 'a') as f:
+                f.write(body + '\n')
+        elif self.kind == 'otlp':
+            request = urllib.request.Request(
+                Config.OTLP_ENDPOINT,
+                data=body.encode(),
+                headers={"Content-Type": "application/json"},
+            )
+            urllib.request.urlopen(request, timeout=5).close()
+
+
+class Tracer:
+    """Minimal span tracer; a no-op unless an exporter is configured"""
+
+    def __init__(self, exporter=None, sample_ratio: float = 1.0):
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        self.local = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        if stack:
+            parent = stack[-1]
+            if parent is None:
+                # Unsampled trace
+                yield NOOP_SPAN
+                return
+            span = Span(name, parent.trace_id, parent.span_id, attributes)
+        elif random.random() < self.sample_ratio:
+            span = Span(name, '%032x' % random.getrandbits(128), None, attributes)
+        else:
+            stack.append(None)
+            try:
+                yield NOOP_SPAN
+            finally:
+                stack.pop()
+            return
+
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            stack.pop()
+            span.end_ns = time.time_ns()
+            self.exporter.submit(span)
+
+
+def create_tracer() -> Tracer:
+    if Config.TRACE_EXPORTER in ('file', 'otlp'):
+        logger.info(f"Tracing enabled: {Config.TRACE_EXPORTER} exporter")
+        return Tracer(SpanExporter(Config.TRACE_EXPORTER), Config.TRACE_SAMPLE_RATIO)
+    return Tracer()
+
+
+tracer = create_tracer()
@@ -0,0 +1,16 @@
+import sys
+import importlib
+from .settings import settings
+
+
+def import_listener_module(name: str):
+    """
+    Import a dicom_listener module
+
+    Adds settings.listener_path to sys.path when it is not installed.
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        sys.path.insert(0, str(settings.listener_path))
+        return importlib.import_module(name)
@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 from fastapi import FastAPI, Response, status
 from fastapi.middleware.cors import CORSMiddleware
@@ -5,6 +6,8 @@ from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 import logging
 from .settings import settings
 from .metrics import setup_metrics
+from .routes import dicom_router, debug_router
+from .volume import evict_volumes
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -27,6 +30,34 @@ app.add_middleware(
 # Initialize metrics
 setup_metrics(app)
 
+app.include_router(dicom_router, prefix="/dicom", tags=["DICOM"])
+if settings.debug:
+    # Unauthenticated: exposes every thread's stack and holds a worker for
+    # the whole profile
+    app.include_router(debug_router, prefix="/debug", tags=["Debug"])
+
+
+async def _evict_volume_cache():
+    """Periodically drop cached volumes for studies past retention"""
+    retention_seconds = settings.study_retention_hours * 3600
+    while True:
+        try:
+            await asyncio.to_thread(
+                evict_volumes,
+                settings.storage_path,
+                settings.volume_cache_path,
+                retention_seconds,
+            )
+        except Exception as e:
+            logger.error(f"Volume cache eviction failed: {e}")
+        await asyncio.sleep(settings.volume_eviction_interval_seconds)
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    app.state.eviction_task = asyncio.create_task(_evict_volume_cache())
+
+
 @app.get("/", include_in_schema=False)
 async def root():
     """Hidden root endpoint that redirects to docs"""
@@ -44,11 +75,52 @@ async def health_check():
         dict: Service status with timestamp
     """
     logger.info("Health check requested")
-    return {
+    health = {
         "status": "ok",
         "version": app.version,
         "timestamp": datetime.datetime.utcnow().isoformat()
     }
+    runtime = getattr(app.state, "runtime", None)
+    if runtime is not None:
+        health["services"] = {"dicom": runtime.status(), "http": "running"}
+    return health
+
+
+@app.get("/dicom-echo")
+def perform_echo_test():
+    """
+    DICOM Verification Service (C-ECHO) against this gateway's SCP
+
+    Returns:
+        dict: Echo outcome
+    """
+    from pynetdicom import AE
+    from pynetdicom.sop_class import Verification
+
+    try:
+        ae = AE(ae_title="GATEWAY_ECHO")
+        ae.add_requested_context(Verification)
+
+        logger.info("Initiating DICOM echo test")
+        assoc = ae.associate(
+            "localhost", settings.dicom_port, ae_title=settings.ae_title
+        )
+        if not assoc.is_established:
+            logger.error("Association rejected")
+            return {"status": "error", "reason": "Association rejected"}
+
+        status = assoc.send_c_echo()
+        assoc.release()
+        if status and status.Status == 0x0000:
+            logger.info("Echo test succeeded")
+            return {"status": "success"}
+
+        logger.error(f"Echo failed with status: {status}")
+        return {"status": "error", "code": status.Status if status else None}
+
+    except Exception as e:
+        logger.error(f"Echo test failed: {e}")
+        return {"status": "error", "reason": str(e)}
 
 @app.get("/metrics")
 async def get_metrics():
@@ -63,7 +135,3 @@ async def get_metrics():
         content=generate_latest(),
         media_type=CONTENT_TYPE_LATEST
     )
-
-# Example of how to add additional routers
-# from .routes import dicom_router
-# app.include_router(dicom_router, prefix="/dicom", tags=["DICOM"])
\ No newline at end of file
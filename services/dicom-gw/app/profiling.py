@@ -0,0 +1,67 @@
+import sys
+import time
+import threading
+from collections import Counter
+
+# Only one profile at a time; overlapping samplers would skew each other
+_profile_lock = threading.Lock()
+
+
+def _thread_label(thread_name: str) -> str:
+    """Collapse names like 'AcceptorThread@2024...' into one stack root"""
+    return thread_name.split("@", 1)[0].replace(";", "_")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename.rsplit("/", 1)[-1]
+    label = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+    return label.replace(";", "_")
+
+
+def sample_stacks(
+    duration: float, interval: float, thread_filter: str = None
+) -> Counter:
+    """
+    Sample the Python stacks of all threads for a fixed duration
+
+    Args:
+        duration: Seconds to sample for
+        interval: Seconds between samples
+        thread_filter: Only sample threads whose name contains this string
+
+    Returns:
+        Counter: Collapsed stack string -> sample count
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+
+    try:
+        me = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                name = names.get(ident, f"thread-{ident}")
+                if thread_filter and thread_filter not in name:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(_frame_label(frame))
+                    frame = frame.f_back
+                frames.append(_thread_label(name))
+                stacks[";".join(reversed(frames))] += 1
+            time.sleep(interval)
+        return stacks
+    finally:
+        _profile_lock.release()
+
+
+def collapse(stacks: Counter) -> str:
+    """Render stacks in the collapsed format of flamegraph.pl and speedscope"""
+    return "".join(
+        f"{stack} {count}\n" for stack, count in stacks.most_common()
+    )
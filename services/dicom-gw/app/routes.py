@@ -0,0 +1,103 @@
+import re
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse, PlainTextResponse
+import logging
+from .settings import settings
+from .volume import assemble_volume, InconsistentSeriesError, VOLUME_FILE
+from .profiling import sample_stacks, collapse
+
+logger = logging.getLogger(__name__)
+
+dicom_router = APIRouter()
+debug_router = APIRouter()
+
+UID_PATTERN = re.compile(r"^[0-9]+(\.[0-9]+)*$")
+
+
+def _build_volume(study_uid: str, series_uid: str) -> dict:
+    """Validate UIDs and assemble (or reuse) the cached volume"""
+    if not (UID_PATTERN.match(study_uid) and UID_PATTERN.match(series_uid)):
+        raise HTTPException(status_code=400, detail="Invalid UID")
+
+    series_path = settings.storage_path / study_uid / series_uid
+    if not series_path.is_dir():
+        raise HTTPException(status_code=404, detail="Series not found")
+
+    try:
+        return assemble_volume(
+            series_path, settings.volume_cache_path / study_uid / series_uid
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Series has no instances")
+    except InconsistentSeriesError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logger.error(
+            f"Volume assembly failed for {series_uid}: {e}", exc_info=True
+        )
+        raise HTTPException(status_code=500, detail="Volume assembly failed")
+
+
+@dicom_router.get("/studies/{study_uid}/series/{series_uid}/volume")
+def get_volume(study_uid: str, series_uid: str):
+    """
+    Assembled series volume
+
+    Returns:
+        FileResponse: float32 .npy (slice, row, column), loadable with
+        mmap_mode='r'
+    """
+    metadata = _build_volume(study_uid, series_uid)
+    return FileResponse(
+        settings.volume_cache_path / study_uid / series_uid / VOLUME_FILE,
+        media_type="application/octet-stream",
+        filename=f"{series_uid}.npy",
+        headers={
+            "X-Volume-Shape": ",".join(str(n) for n in metadata["shape"])
+        },
+    )
+
+
+@dicom_router.get("/studies/{study_uid}/series/{series_uid}/volume/metadata")
+def get_volume_metadata(study_uid: str, series_uid: str):
+    """
+    Spacing, orientation and slice order of the assembled series volume
+
+    Returns:
+        dict: Volume metadata, including the local path of the cached .npy
+    """
+    metadata = _build_volume(study_uid, series_uid)
+    path = settings.volume_cache_path / study_uid / series_uid / VOLUME_FILE
+    return {**metadata, "path": str(path)}
+
+
+@debug_router.get("/profile", response_class=PlainTextResponse)
+def profile(
+    seconds: float = Query(10.0, gt=0),
+    interval_ms: float = Query(10.0, ge=1),
+    thread: str = Query(
+        None,
+        description="Only sample threads whose name contains this, "
+        "e.g. AcceptorThread",
+    ),
+):
+    """
+    Time-boxed sampling profile of the process threads (SCP associations
+    included)
+
+    Returns:
+        PlainTextResponse: Collapsed stacks, one 'frame;frame;... count' line
+        per stack
+    """
+    seconds = min(seconds, settings.profile_max_seconds)
+    try:
+        stacks = sample_stacks(seconds, interval_ms / 1000, thread)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info(f"Profiled {sum(stacks.values())} samples over {seconds}s")
+    return PlainTextResponse(
+        collapse(stacks),
+        headers={
+            "Content-Disposition": 'attachment; filename="profile.collapsed"'
+        },
+    )
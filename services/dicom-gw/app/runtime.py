@@ -0,0 +1,149 @@
+"""
+Single-process gateway runtime
+
+Hosts the DICOM SCP (dicom_listener/listener.py), the background workers
+and the HTTP API in one process so they share in-memory state. The SCP is
+started before FastAPI/uvicorn are imported, so a restarted gateway accepts
+associations as soon as pynetdicom is loaded.
+
+Run with: python -m app.runtime
+"""
+import time
+import signal
+import logging
+import threading
+from .settings import settings
+from .listener_modules import import_listener_module
+
+STARTED = time.perf_counter()
+
+logger = logging.getLogger(__name__)
+
+
+def load_listener():
+    listener = import_listener_module("listener")
+    listener.Config.STORAGE_PATH = settings.storage_path
+    listener.Config.LISTEN_PORT = settings.dicom_port
+    listener.Config.AE_TITLE = settings.ae_title
+    # One retention window for the registry and the volume cache
+    listener.Config.STUDY_RETENTION_HOURS = settings.study_retention_hours
+    listener.registry.retention_seconds = settings.study_retention_hours * 3600
+    return listener
+
+
+class GatewayRuntime:
+    """Owns the SCP server and its shutdown; the API's app.state.runtime"""
+
+    def __init__(self):
+        self.listener = None
+        self.scp = None
+        self.accepting = False
+        self.draining = threading.Event()
+        self.startup_seconds = None
+
+    def start_scp(self):
+        self.listener = load_listener()
+        self.scp = self.listener.start_server(block=False)
+        self.accepting = True
+        self.startup_seconds = time.perf_counter() - STARTED
+        logger.info(
+            f"SCP accepting associations "
+            f"{self.startup_seconds * 1000:.0f} ms after start"
+        )
+
+    @property
+    def active_associations(self) -> list:
+        return self.scp.active_associations if self.scp else []
+
+    def stop_accepting(self):
+        """Close the listening socket; in-flight associations keep running"""
+        if self.draining.is_set():
+            return
+        self.draining.set()
+        if self.scp:
+            self.scp.shutdown()
+        self.accepting = False
+        logger.info(
+            f"SCP stopped accepting, "
+            f"draining {len(self.active_associations)} associations"
+        )
+
+    def drain(self, timeout: float):
+        """
+        Wait for in-flight associations, then abort stragglers and shut the
+        listener down
+        """
+        self.stop_accepting()
+        deadline = time.monotonic() + timeout
+        while self.active_associations and time.monotonic() < deadline:
+            time.sleep(0.1)
+        for assoc in self.active_associations:
+            logger.warning(
+                f"Aborting association from {assoc.requestor.ae_title} "
+                f"after drain timeout"
+            )
+            assoc.abort()
+        if self.listener:
+            self.listener.shutdown()
+        logger.info("Gateway drained")
+
+    def status(self) -> dict:
+        if self.draining.is_set():
+            dicom = "draining"
+        else:
+            dicom = "running" if self.accepting else "stopped"
+        startup_ms = None
+        if self.startup_seconds:
+            startup_ms = round(self.startup_seconds * 1000)
+        status = {
+            "dicom": dicom,
+            "active_associations": len(self.active_associations),
+            "startup_ms": startup_ms,
+        }
+        if self.listener:
+            status["tls_handshakes"] = self.listener.handshake_stats.snapshot()
+            status["tracked_studies"] = len(self.listener.registry)
+            if self.listener.deid_stage.enabled:
+                status["deid"] = self.listener.deid_stage.stats()
+        return status
+
+
+def main():
+    runtime = GatewayRuntime()
+    runtime.start_scp()
+
+    # Until uvicorn installs its own handlers, a SIGTERM only needs to stop
+    # the SCP
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: runtime.stop_accepting())
+
+    import uvicorn
+    from .main import app
+
+    app.state.runtime = runtime
+
+    class GatewayServer(uvicorn.Server):
+        def handle_exit(self, sig, frame):
+            # SIGTERM/SIGINT: stop taking new associations before HTTP winds
+            # down
+            threading.Thread(
+                target=runtime.stop_accepting, name="scp-drain"
+            ).start()
+            super().handle_exit(sig, frame)
+
+    server = GatewayServer(uvicorn.Config(
+        app,
+        host="0.0.0.0",
+        port=settings.http_port,
+        log_config=None,
+        access_log=False,
+    ))
+    try:
+        if not runtime.draining.is_set():
+            server.run()
+    finally:
+        runtime.drain(settings.drain_timeout_seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+from pathlib import Path
+
 from pydantic_settings import BaseSettings
 
 
@@ -5,7 +7,27 @@ class Settings(BaseSettings):
     app_name: str = "DICOM Gateway"
     debug: bool = False
 
+    # Shared with the SCP, which stores instances as <study>/<series>/<sop>.dcm
+    storage_path: Path = Path("./buffer")
+    volume_cache_path: Path = Path("./volume_cache")
+    # How long a study is tracked after its last instance: cached volumes
+    # here, and the SCP's study registry (STUDY_RETENTION_HOURS in both)
+    study_retention_hours: float = 72.0
+    volume_eviction_interval_seconds: int = 600
+    profile_max_seconds: float = 60.0
+
+    # Unified runtime (app/runtime.py): SCP + HTTP API in one process
+    http_port: int = 8000
+    dicom_port: int = 11112
+    ae_title: str = "DICOM_GATEWAY"
+    drain_timeout_seconds: float = 30.0
+    # Location of the SCP implementation (dicom_listener/listener.py)
+    listener_path: Path = (
+        Path(__file__).resolve().parent.parent.parent.parent / "dicom_listener"
+    )
+
     class Config:
         env_file = ".env"
 
+
 settings = Settings()
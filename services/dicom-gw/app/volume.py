@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+VOLUME_FILE = "volume.npy"
+METADATA_FILE = "volume.json"
+
+# One lock per series so concurrent requests for the same volume assemble it
+# once
+_series_locks = {}
+_series_locks_guard = threading.Lock()
+
+
+class InconsistentSeriesError(ValueError):
+    """Slices of a series cannot be stacked into one volume"""
+
+
+def _series_lock(key: str) -> threading.Lock:
+    with _series_locks_guard:
+        return _series_locks.setdefault(key, threading.Lock())
+
+
+def _forget_series_locks(study_cache: Path):
+    """Drop the locks of an evicted study's series, except any still held"""
+    prefix = str(study_cache) + os.sep
+    with _series_locks_guard:
+        for key in [key for key in _series_locks if key.startswith(prefix)]:
+            if not _series_locks[key].locked():
+                del _series_locks[key]
+
+
+def _source_signature(dcm_files) -> dict:
+    """Cheap fingerprint of a series directory used to validate the cache"""
+    return {
+        "instance_count": len(dcm_files),
+        "latest_mtime": max(f.stat().st_mtime for f in dcm_files),
+    }
+
+
+def _read_cached_metadata(cache_dir: Path):
+    try:
+        with open(cache_dir / METADATA_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def assemble_volume(series_path: Path, cache_dir: Path) -> dict:
+    """
+    Build (or reuse) a cached float32 volume for one series
+
+    Slices are ordered along the slice normal using ImagePositionPatient and
+    rescaled with RescaleSlope/RescaleIntercept. The volume is written as a
+    .npy file that consumers can open with np.load(path, mmap_mode='r').
+
+    Returns:
+        dict: Volume metadata (shape, spacing, orientation, origin, ...)
+    """
+    # Deferred so the runtime starts without loading NumPy and pixel codecs
+    import numpy as np
+    import pydicom
+
+    dcm_files = sorted(series_path.glob("*.dcm"))
+    if not dcm_files:
+        raise FileNotFoundError(f"No DICOM instances in {series_path}")
+
+    with _series_lock(str(cache_dir)):
+        signature = _source_signature(dcm_files)
+        cached = _read_cached_metadata(cache_dir)
+        if (
+            cached
+            and cached.get("source") == signature
+            and (cache_dir / VOLUME_FILE).exists()
+        ):
+            return cached
+
+        # Headers only: pixel data is read one slice at a time while filling
+        # the volume
+        datasets = [
+            pydicom.dcmread(f, stop_before_pixels=True) for f in dcm_files
+        ]
+        first = datasets[0]
+        dimensions = {(int(ds.Rows), int(ds.Columns)) for ds in datasets}
+        if len(dimensions) > 1:
+            raise InconsistentSeriesError(
+                f"Slices differ in Rows/Columns: {sorted(dimensions)}"
+            )
+
+        orientation = np.array(
+            getattr(first, "ImageOrientationPatient", [1, 0, 0, 0, 1, 0]),
+            dtype=np.float64,
+        )
+        normal = np.cross(orientation[:3], orientation[3:])
+        positions = np.array(
+            [
+                getattr(ds, "ImagePositionPatient", [0, 0, i])
+                for i, ds in enumerate(datasets)
+            ],
+            dtype=np.float64,
+        )
+        order = np.argsort(positions @ normal, kind="stable")
+        datasets = [datasets[i] for i in order]
+        dcm_files = [dcm_files[i] for i in order]
+        positions = positions[order]
+
+        slopes = np.array(
+            [float(getattr(ds, "RescaleSlope", 1)) for ds in datasets],
+            dtype=np.float32,
+        )
+        intercepts = np.array(
+            [float(getattr(ds, "RescaleIntercept", 0)) for ds in datasets],
+            dtype=np.float32,
+        )
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        shape = (len(datasets), int(first.Rows), int(first.Columns))
+        tmp_path = cache_dir / f".{VOLUME_FILE}.{os.getpid()}.tmp"
+
+        # Write straight into a memory-mapped .npy; only one slice's pixels
+        # are in memory at a time
+        try:
+            volume = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=np.float32, shape=shape
+            )
+            try:
+                for i, path in enumerate(dcm_files):
+                    volume[i] = pydicom.dcmread(path).pixel_array
+                    volume[i] *= slopes[i]
+                    volume[i] += intercepts[i]
+                volume.flush()
+            finally:
+                # Unmap before the file is replaced or unlinked
+                del volume
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        os.replace(tmp_path, cache_dir / VOLUME_FILE)
+
+        slice_offsets = positions @ normal
+        if len(slice_offsets) > 1:
+            slice_spacing = float(np.median(np.diff(slice_offsets)))
+        else:
+            slice_spacing = float(
+                getattr(first, "SliceThickness", 1.0) or 1.0
+            )
+        pixel_spacing = [
+            float(v) for v in getattr(first, "PixelSpacing", [1.0, 1.0])
+        ]
+
+        metadata = {
+            "study_uid": str(first.StudyInstanceUID),
+            "series_uid": str(first.SeriesInstanceUID),
+            "shape": list(shape),
+            "dtype": "float32",
+            "axes": ["slice", "row", "column"],
+            "spacing": [slice_spacing] + pixel_spacing,
+            "origin": positions[0].tolist(),
+            "orientation": orientation.tolist(),
+            "sop_instance_uids": [str(ds.SOPInstanceUID) for ds in datasets],
+            "source": signature,
+            "created": time.time(),
+        }
+        with open(cache_dir / METADATA_FILE, "w") as f:
+            json.dump(metadata, f)
+
+        logger.info(
+            f"Assembled volume {shape} for series {metadata['series_uid']}"
+        )
+        return metadata
+
+
+def evict_volumes(
+    storage_path: Path, cache_path: Path, retention_seconds: float
+) -> int:
+    """
+    Remove cached volumes whose study has left retention
+
+    A study's cache is dropped when the study directory no longer exists in
+    storage or when it has not received an instance within the retention
+    window.
+
+    Returns:
+        int: Number of studies evicted from the cache
+    """
+    if not cache_path.exists():
+        return 0
+
+    now = time.time()
+    evicted = 0
+    for study_cache in cache_path.iterdir():
+        if not study_cache.is_dir():
+            continue
+        study_dir = storage_path / study_cache.name
+        try:
+            # Series directories get a new mtime whenever an instance is stored
+            last_activity = max(
+                [study_dir.stat().st_mtime]
+                + [
+                    d.stat().st_mtime
+                    for d in study_dir.iterdir() if d.is_dir()
+                ]
+            )
+            expired = now - last_activity > retention_seconds
+        except FileNotFoundError:
+            expired = True
+        if expired:
+            shutil.rmtree(study_cache, ignore_errors=True)
+            _forget_series_locks(study_cache)
+            evicted += 1
+            logger.info(
+                f"Evicted cached volumes for study {study_cache.name}"
+            )
+    return evicted
@@ -1,18 +1,26 @@
 ﻿# services/dicom-gw/publisher.py
 import pika
-import json
 import os
+from app.listener_modules import import_listener_module
+
+# Same versioned schema as the SCP's notifications
+# (dicom_listener/notifications.py)
+notifications = import_listener_module("notifications")
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 QUEUE_NAME = "new_study"
+ENCODING = notifications.resolve_encoding(
+    os.getenv("NOTIFICATION_ENCODING", "json")
+)
+
 
 def publish_study_summary(study_uid, patient_name, modality, num_slices):
-    message = {
-        "StudyInstanceUID": study_uid,
-        "PatientName": patient_name,
-        "Modality": modality,
-        "NumberOfSlices": num_slices
-    }
+    # Replaces the old StudyInstanceUID/PatientName/Modality/NumberOfSlices
+    # body
+    message = notifications.build_notification(
+        study_uid, None, modality, num_slices, patient_name=patient_name
+    )
+    body, content_type = notifications.encode(message, ENCODING)
 
     connection = pika.BlockingConnection(
         pika.ConnectionParameters(host=RABBITMQ_HOST)
@@ -23,8 +31,11 @@ def publish_study_summary(study_uid, patient_name, modality, num_slices):
     channel.basic_publish(
         exchange="",
         routing_key=QUEUE_NAME,
-        body=json.dumps(message),
+        body=body,
         properties=pika.BasicProperties(
+            content_type=content_type,
+            correlation_id=study_uid,
+            headers=notifications.headers(message),
             delivery_mode=2  # Make message persistent
         )
     )
@@ -0,0 +1,61 @@
+import re
+import threading
+import time
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.profiling import sample_stacks, collapse
+from app.routes import debug_router
+
+COLLAPSED_LINE = re.compile(r"^[^ ;]+(;[^;]+)* \d+$")
+
+
+def busy_wait(stop):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+def test_collapsed_stacks_are_rooted_at_the_thread():
+    stop = threading.Event()
+    worker = threading.Thread(
+        target=busy_wait, args=(stop,), name="AcceptorThread@1234"
+    )
+    worker.start()
+    try:
+        # Full name: SCP tests in the same run may leave acceptor threads
+        stacks = sample_stacks(0.2, 0.01, thread_filter="AcceptorThread@1234")
+    finally:
+        stop.set()
+        worker.join()
+
+    lines = collapse(stacks).splitlines()
+    assert lines and all(COLLAPSED_LINE.match(line) for line in lines)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert stack.startswith("AcceptorThread;")
+    assert "busy_wait (test_profiling.py:" in stack
+    assert int(count) > 1
+
+
+def test_second_concurrent_profile_is_rejected():
+    debug_app = FastAPI()
+    debug_app.include_router(debug_router, prefix="/debug")
+    client = TestClient(debug_app)
+
+    first = {}
+    running = threading.Thread(
+        target=lambda: first.update(
+            response=client.get("/debug/profile?seconds=1")
+        )
+    )
+    running.start()
+    time.sleep(0.3)
+    second = client.get("/debug/profile?seconds=1")
+    running.join()
+
+    assert first["response"].status_code == 200
+    assert second.status_code == 409
+
+
+def test_profile_endpoint_needs_debug():
+    assert TestClient(app).get("/debug/profile?seconds=0.1").status_code == 404
@@ -0,0 +1,107 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import json
+import urllib.request
+from pathlib import Path
+import pytest
+from pynetdicom import AE
+from pynetdicom.sop_class import Verification
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def echo(port):
+    ae = AE()
+    ae.add_requested_context(Verification)
+    assoc = ae.associate("localhost", port)
+    if not assoc.is_established:
+        return False
+    assoc.release()
+    return True
+
+
+@pytest.fixture
+def runtime(tmp_path):
+    dicom_port, http_port = free_port(), free_port()
+    env = dict(
+        os.environ,
+        DICOM_PORT=str(dicom_port),
+        HTTP_PORT=str(http_port),
+        STORAGE_PATH=str(tmp_path / "buffer"),
+        VOLUME_CACHE_PATH=str(tmp_path / "volume_cache"),
+        RABBITMQ_HOST="127.0.0.1",
+        DRAIN_TIMEOUT_SECONDS="10",
+        PYTHONPATH=str(SERVICE_DIR),
+    )
+    started = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "app.runtime"], cwd=tmp_path, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    while not echo(dicom_port):
+        assert process.poll() is None, "runtime exited during startup"
+        assert time.monotonic() - started < 30, "SCP did not start"
+        time.sleep(0.05)
+
+    yield process, dicom_port, http_port
+
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.load(response)
+
+
+def wait_for_http(http_port):
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            return get_json(f"http://localhost:{http_port}/health")
+        except OSError:
+            assert time.monotonic() < deadline, "HTTP API did not start"
+            time.sleep(0.1)
+
+
+def test_scp_and_http_share_one_process(runtime):
+    _, _, http_port = runtime
+
+    health = wait_for_http(http_port)
+    assert health["services"]["dicom"]["dicom"] == "running"
+    # "Well under a second" from loading the runtime to accepting associations
+    assert health["services"]["dicom"]["startup_ms"] < 1000
+    echo = get_json(f"http://localhost:{http_port}/dicom-echo")
+    assert echo == {"status": "success"}
+
+
+def test_sigterm_drains_open_associations(runtime):
+    process, dicom_port, http_port = runtime
+    wait_for_http(http_port)
+
+    ae = AE()
+    ae.add_requested_context(Verification)
+    assoc = ae.associate("localhost", dicom_port)
+    assert assoc.is_established
+
+    process.send_signal(signal.SIGTERM)
+    time.sleep(1)
+
+    # New associations are refused while the open one still works
+    assert not echo(dicom_port)
+    assert assoc.send_c_echo().Status == 0x0000
+    assert process.poll() is None
+
+    assoc.release()
+    assert process.wait(timeout=10) == 0
@@ -0,0 +1,114 @@
+import os
+import time
+import numpy as np
+import pytest
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import generate_uid, ExplicitVRLittleEndian
+
+from app import volume as volume_module
+from app.volume import (
+    assemble_volume, evict_volumes, InconsistentSeriesError, VOLUME_FILE
+)
+
+ROWS, COLUMNS = 4, 3
+SLICE_Z = [20.0, 0.0, 10.0, 30.0]  # deliberately out of order on disk
+
+
+def write_slice(series_path, study_uid, series_uid, z, value, rows=ROWS):
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.2"
+    ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+
+    ds.SOPClassUID = ds.file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = study_uid
+    ds.SeriesInstanceUID = series_uid
+    ds.Modality = "CT"
+    ds.ImagePositionPatient = [0.0, 0.0, z]
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    ds.PixelSpacing = [0.5, 0.7]
+    ds.RescaleSlope = 2
+    ds.RescaleIntercept = -1024
+    ds.Rows = rows
+    ds.Columns = COLUMNS
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.PixelData = np.full((rows, COLUMNS), value, dtype=np.uint16).tobytes()
+    ds.save_as(
+        series_path / f"{ds.SOPInstanceUID}.dcm", write_like_original=False
+    )
+
+
+@pytest.fixture
+def series(tmp_path):
+    study_uid, series_uid = generate_uid(), generate_uid()
+    series_path = tmp_path / "buffer" / study_uid / series_uid
+    series_path.mkdir(parents=True)
+    for z in SLICE_Z:
+        write_slice(series_path, study_uid, series_uid, z, value=int(z))
+    return tmp_path, study_uid, series_uid
+
+
+def test_volume_sorted_and_rescaled(series):
+    root, study_uid, series_uid = series
+    cache_dir = root / "cache" / study_uid / series_uid
+
+    series_path = root / "buffer" / study_uid / series_uid
+    metadata = assemble_volume(series_path, cache_dir)
+
+    volume = np.load(cache_dir / VOLUME_FILE, mmap_mode="r")
+    assert volume.shape == (len(SLICE_Z), ROWS, COLUMNS)
+    expected = [z * 2 - 1024 for z in sorted(SLICE_Z)]
+    assert volume[:, 0, 0].tolist() == expected
+    assert metadata["spacing"] == [10.0, 0.5, 0.7]
+    assert metadata["origin"] == [0.0, 0.0, 0.0]
+
+
+def test_volume_cache_reused_until_series_changes(series):
+    root, study_uid, series_uid = series
+    series_path = root / "buffer" / study_uid / series_uid
+    cache_dir = root / "cache" / study_uid / series_uid
+
+    first = assemble_volume(series_path, cache_dir)
+    again = assemble_volume(series_path, cache_dir)
+    assert again["created"] == first["created"]
+
+    write_slice(series_path, study_uid, series_uid, 40.0, value=40)
+    rebuilt = assemble_volume(series_path, cache_dir)
+    assert rebuilt["shape"][0] == len(SLICE_Z) + 1
+
+
+def test_mismatched_slice_dimensions_are_rejected(series):
+    root, study_uid, series_uid = series
+    series_path = root / "buffer" / study_uid / series_uid
+    cache_dir = root / "cache" / study_uid / series_uid
+    write_slice(
+        series_path, study_uid, series_uid, 40.0, value=40, rows=ROWS + 1
+    )
+
+    with pytest.raises(InconsistentSeriesError):
+        assemble_volume(series_path, cache_dir)
+    assert not (cache_dir / VOLUME_FILE).exists()
+
+
+def test_evict_volumes_follows_study_retention(series):
+    root, study_uid, series_uid = series
+    storage_path, cache_path = root / "buffer", root / "cache"
+    series_path = storage_path / study_uid / series_uid
+    cache_dir = cache_path / study_uid / series_uid
+    assemble_volume(series_path, cache_dir)
+
+    assert evict_volumes(storage_path, cache_path, retention_seconds=3600) == 0
+
+    stale = time.time() - 7200
+    for path in (storage_path / study_uid, series_path):
+        os.utime(path, (stale, stale))
+    assert evict_volumes(storage_path, cache_path, retention_seconds=3600) == 1
+    assert not (cache_path / study_uid).exists()
+    assert str(cache_dir) not in volume_module._series_locks
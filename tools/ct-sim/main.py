@@ -3,17 +3,25 @@ from pynetdicom import AE, evt
 from pydicom import dcmread
 import os
 import threading
+from tls_session import client_context, summary
 
 def send_slices(args):
     ae = AE(ae_title=args.gateway_ae)
     ae.add_requested_context('1.2.840.10008.5.1.4.1.1.2')  # CT Storage
+    tls_args = None
+    if args.tls:
+        # One association per slice: resumption turns each full handshake into an abbreviated one
+        ssl_ctx = client_context(args.tls_ciphers, resume=not args.no_tls_resume)
+        tls_args = (ssl_ctx, args.gateway_host)
     for fname in os.listdir(args.src):
         if not fname.endswith('.dcm'): continue
         ds = dcmread(os.path.join(args.src, fname))
-        assoc = ae.associate(args.gateway_host, args.gateway_port)
+        assoc = ae.associate(args.gateway_host, args.gateway_port, tls_args=tls_args)
         if assoc.is_established:
             assoc.send_c_store(ds)
             assoc.release()
+    if tls_args:
+        print(summary(tls_args[0]))
 
 def handle_echo(event):
     return 0x0000  # Success
@@ -25,6 +33,9 @@ if __name__ == '__main__':
     parser.add_argument('--gateway-ae', default='PY_GATEWAY')
     parser.add_argument('--gateway-host', default='dicom-gw')
     parser.add_argument('--gateway-port', type=int, default=104)
+    parser.add_argument('--tls', action='store_true')
+    parser.add_argument('--tls-ciphers', default='performance')
+    parser.add_argument('--no-tls-resume', action='store_true')
     args = parser.parse_args()
 
     # Start SCP
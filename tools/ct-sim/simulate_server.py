@@ -4,6 +4,7 @@ from pydicom import dcmread
 from pynetdicom import AE, build_context
 from pynetdicom.sop_class import CTImageStorage
 from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+from tls_session import client_context, summary
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DICOM_FOLDER = os.path.join(SCRIPT_DIR, "datasets", "chest")
@@ -12,6 +13,7 @@ GATEWAY_HOST = "localhost"
 GATEWAY_PORT = 11112
 AE_TITLE = "CT-SIM"
 TLS_ENABLED = os.getenv("TLS_ENABLED", "false").lower() == "true"
+TLS_CIPHERS = os.getenv("TLS_CIPHER_POLICY", "performance")
 
 def send_ct_study():
     ae = AE(ae_title=AE_TITLE)
@@ -19,11 +21,7 @@ def send_ct_study():
 
     tls_args = None
     if TLS_ENABLED:
-        import ssl
-        ssl_ctx = ssl.create_default_context()
-        ssl_ctx.check_hostname = False
-        ssl_ctx.verify_mode = ssl.CERT_NONE
-        tls_args = (ssl_ctx, "localhost")
+        tls_args = (client_context(TLS_CIPHERS), "localhost")
 
     assoc = ae.associate(GATEWAY_HOST, GATEWAY_PORT, ae_title="ANY-SCP", tls_args=tls_args)
 
@@ -47,6 +45,8 @@ def send_ct_study():
         time.sleep(0.2)
 
     assoc.release()
+    if tls_args:
+        print(summary(tls_args[0]))
 
 if __name__ == "__main__":
     send_ct_study()
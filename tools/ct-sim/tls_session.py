@@ -0,0 +1,77 @@
+import ssl
+import time
+
+# TLS 1.2 cipher strings, kept in step with the gateway's TLS_CIPHER_POLICY names
+CIPHER_POLICIES = {
+    'strict': 'ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-GCM-SHA384',
+    'performance': 'ECDHE-ECDSA-AES128-GCM-SHA256:ECDHE-RSA-AES128-GCM-SHA256:'
+                   'ECDHE-ECDSA-CHACHA20-POLY1305:ECDHE-RSA-CHACHA20-POLY1305:'
+                   'ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-GCM-SHA384',
+    'chacha20': 'ECDHE-ECDSA-CHACHA20-POLY1305:ECDHE-RSA-CHACHA20-POLY1305:'
+                'ECDHE-ECDSA-AES128-GCM-SHA256:ECDHE-RSA-AES128-GCM-SHA256',
+}
+
+
+class ResumingSSLSocket(ssl.SSLSocket):
+    """Client socket that times handshakes and hands its session back to the context"""
+
+    def do_handshake(self, block=False):
+        start = time.perf_counter()
+        super().do_handshake(block)
+        stats = self.context.stats
+        stats["handshakes"] += 1
+        stats["resumed"] += self.session_reused
+        stats["seconds"] += time.perf_counter() - start
+        self._remember_session()
+
+    def _remember_session(self):
+        if self.session is not None:
+            self.context.sessions[self.server_hostname] = self.session
+
+    def shutdown(self, how):
+        # TLS 1.3 tickets arrive after the handshake, so refresh before closing
+        try:
+            self._remember_session()
+        except (ValueError, OSError):
+            pass
+        super().shutdown(how)
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """Offers the last session seen for a hostname, so per-slice associations resume"""
+
+    sslsocket_class = ResumingSSLSocket
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True,
+                    suppress_ragged_eofs=True, server_hostname=None, session=None):
+        if session is None and not server_side and self.resume:
+            session = self.sessions.get(server_hostname)
+        return super().wrap_socket(
+            sock,
+            server_side=server_side,
+            do_handshake_on_connect=do_handshake_on_connect,
+            suppress_ragged_eofs=suppress_ragged_eofs,
+            server_hostname=server_hostname,
+            session=session,
+        )
+
+
+def client_context(ciphers='performance', resume=True):
+    """Unverified SCU context (self-signed gateway certs) with optional session resumption"""
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.resume = resume
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(CIPHER_POLICIES.get(ciphers, ciphers))
+    context.sessions = {}
+    context.stats = {"handshakes": 0, "resumed": 0, "seconds": 0.0}
+    return context
+
+
+def summary(context):
+    stats = getattr(context, "stats", None)
+    if not stats or not stats["handshakes"]:
+        return "no TLS handshakes recorded"
+    mean_ms = 1000 * stats["seconds"] / stats["handshakes"]
+    return f"{stats['handshakes']} TLS handshakes, {stats['resumed']} resumed, mean {mean_ms:.2f} ms"